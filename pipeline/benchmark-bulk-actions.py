@@ -0,0 +1,72 @@
+#Benchmark of the bulk body generation: iterrows actions serialized by the opensearch helpers (former pipelines)
+#against the column-wise bulkmodule.frame_ndjson.
+#Usage: python3 pipeline/benchmark-bulk-actions.py [csv folder]
+#With a folder, the TED CSVs in it are read with csvmodule.read_csvs, otherwise a synthetic frame of SYNTHETIC_ROWS
+#rows is used. Both paths must give the same documents (NaN values are now sent as null).
+import json
+import sys
+import time
+import numpy as np
+import pandas as pd
+from opensearchpy.helpers.actions import expand_action
+from opensearchpy.serializer import JSONSerializer
+from pipelinepackage.bulkmodule import frame_ndjson
+
+INDEX = 'ted-csv'
+SYNTHETIC_ROWS = 100000  # Same size as a BULK_ROWS chunk of csv-pipeline
+
+
+# -------------------------------- FORMER IMPLEMENTATION --------------------------------
+def iterrows_ndjson(df, index):
+    serializer = JSONSerializer()
+    actions = [
+        {
+            "_op_type": "index",
+            "_index": index,
+            "_id": id_doc,
+            **{f"{col_name}": doc[col_name] for col_name in df.columns}
+        }
+        for id_doc, doc in df.iterrows()
+    ]
+    pairs = []
+    for action in actions:
+        op, source = expand_action(action)
+        pairs.append((serializer.dumps(op), serializer.dumps(source)))
+    return pairs
+
+
+# -------------------------------- DATA --------------------------------
+def synthetic_frame(rows):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        'DT_DISPATCH': pd.to_datetime('2023-01-01') + pd.to_timedelta(rng.integers(0, 365, rows), unit='D'),
+        'CAE_NAME': rng.choice(['Ayuntamiento de Madrid', 'Stadt Wien', 'Région Île-de-France'], rows),
+        'ISO_COUNTRY_CODE': rng.choice(['ES', 'AT', 'FR'], rows),
+        'CPV': rng.integers(3000000, 98000000, rows),
+        'LOTS_NUMBER': rng.integers(0, 20, rows),
+        'B_ON_BEHALF': rng.random(rows) < 0.5,
+        'B_FRA_AGREEMENT': rng.random(rows) < 0.5,
+        'VALUE_EURO_FIN_2': np.where(rng.random(rows) < 0.3, np.nan, rng.random(rows) * 1e6),
+    }, index=[f"{i:08}-2023" for i in range(rows)])
+    return df
+
+
+# -------------------------------- CODE --------------------------------
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        from pipelinepackage.csvmodule import read_csvs
+        df = read_csvs(sys.argv[1])
+    else:
+        df = synthetic_frame(SYNTHETIC_ROWS)
+    timings = {}
+    start = time.perf_counter()
+    former = iterrows_ndjson(df, INDEX)
+    timings["iterrows"] = time.perf_counter() - start
+    start = time.perf_counter()
+    current = list(frame_ndjson(df, INDEX))
+    timings["column-wise"] = time.perf_counter() - start
+    for (former_op, former_source), (op, source) in zip(former, current):
+        if json.loads(former_op) != json.loads(op) or \
+                json.loads(former_source.replace('NaN', 'null')) != json.loads(source):
+            sys.exit(f"The documents differ:\n{former_source}\n{source}")
+    print(f"{len(df)} rows: " + ", ".join(f"{label} {seconds:.2f}s" for label, seconds in timings.items()))
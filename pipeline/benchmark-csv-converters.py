@@ -0,0 +1,105 @@
+#Benchmark of the TED CSV typed read: per-cell converters in pd.read_csv (former read_csvs) against the vectorised
+#column converters of csvmodule.read_csv_file.
+#Usage: python3 pipeline/benchmark-csv-converters.py [export_CAN_<year>.csv ...]
+#Without arguments, a synthetic multi-year file of SYNTHETIC_ROWS rows is generated. Both paths must give the same frame.
+import csv
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime as dt
+import pandas as pd
+from pipelinepackage.csvmodule import read_csv_file, COLUMNS_CAN_LEVEL, DTYPES, BOOL_COLS, INT_COLS
+
+SYNTHETIC_ROWS = 500000
+SYNTHETIC_YEARS = range(2019, 2024)
+
+
+# -------------------------------- FORMER IMPLEMENTATION --------------------------------
+def bool_converter(value):
+    if pd.isnull(value) or value =='':
+        return False
+    elif value == 'Y' or value == '1':
+        return True
+    elif value == 'N' or value == '0':
+        return False
+    else:
+        raise ValueError(f"Unexpected value '{value}' found in the column.")
+def int_converter(value):
+    if pd.isnull(value) or value =='':
+        return -1
+    else:
+        return int(value)
+def lots_converter(value):
+    if pd.isnull(value) or value == '' or pd.isna(value):
+        return 0
+    elif value.isdigit():
+        return int(value)
+    else:
+        raise ValueError(f"Unexpected value '{value}' found in the column.")
+def date_converter(value):
+    return dt.strptime(value, '%d/%m/%y')
+
+
+def read_csv_converters(file_path):
+    converters = {col: bool_converter for col in BOOL_COLS}
+    converters.update({col: int_converter for col in INT_COLS})
+    converters['LOTS_NUMBER'] = lots_converter
+    converters['DT_DISPATCH'] = date_converter
+    return pd.read_csv(file_path, usecols=COLUMNS_CAN_LEVEL, dtype=DTYPES, converters=converters)
+
+
+# -------------------------------- DATA --------------------------------
+def synthetic_value(col):
+    if col in BOOL_COLS:
+        return random.choice(['Y', 'N', '', '1', '0'])
+    if col in INT_COLS:
+        return random.choice(['', '45000000', '3'])
+    if col == 'LOTS_NUMBER':
+        return random.choice(['', '1', '12'])
+    if col == 'DT_DISPATCH':
+        return f"{random.randint(1, 28):02}/{random.randint(1, 12):02}/{random.randint(19, 23)}"
+    if col == 'CANCELLED':
+        return random.choice(['0', '1'])
+    if DTYPES.get(col) == 'float':
+        return random.choice(['', '1520.5', '100000'])
+    return random.choice(['', 'Ayuntamiento, "Madrid"', 'ES', 'UK', 'NA'])
+
+
+def write_synthetic_csv(file_path, rows):
+    with open(file_path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(COLUMNS_CAN_LEVEL + ['ID_LOT'])
+        row, lot = None, 0
+        for i in range(rows):
+            if row is None or random.random() < 0.4:  # New notice, otherwise another lot of the same notice
+                year = random.choice(SYNTHETIC_YEARS)
+                row = [f"{year}{i}" if col == 'ID_NOTICE_CAN' else synthetic_value(col) for col in COLUMNS_CAN_LEVEL]
+                lot = 0
+            lot += 1
+            writer.writerow(row + [lot])
+
+
+# -------------------------------- CODE --------------------------------
+if __name__ == "__main__":
+    temp_folder = None
+    if len(sys.argv) > 1:
+        files = sys.argv[1:]
+    else:
+        random.seed(0)
+        temp_folder = tempfile.TemporaryDirectory()
+        files = [os.path.join(temp_folder.name, "export_CAN_synthetic.csv")]
+        write_synthetic_csv(files[0], SYNTHETIC_ROWS)
+    for file_path in files:
+        timings = {}
+        frames = {}
+        for label, function in (("converters", read_csv_converters), ("vectorised", read_csv_file)):
+            start = time.perf_counter()
+            frames[label] = function(file_path)
+            timings[label] = time.perf_counter() - start
+        pd.testing.assert_frame_equal(frames["converters"], frames["vectorised"], check_dtype=False)
+        print(f"{os.path.basename(file_path)} ({len(frames['vectorised'])} rows): "
+              f"converters {timings['converters']:.2f}s, vectorised {timings['vectorised']:.2f}s")
+    if temp_folder is not None:
+        temp_folder.cleanup()
@@ -0,0 +1,237 @@
+#Benchmark of the eForms award and contracting authority extraction: linear scans of the notice lists (former
+#eformsprocessingmodule) against the indexes by ID built once per notice.
+#Usage: python3 pipeline/benchmark-eforms-awards.py [eForms notice .xml or folder ...]
+#Folders are searched for their LARGEST_NOTICES largest .xml files. Without arguments, a synthetic framework notice of
+#SYNTHETIC_LOTS lots, each with its own tenderer, is generated. Both implementations must give the same awards.
+import os
+import sys
+import timeit
+from datetime import datetime
+from pipelinepackage.xmlmodule import process_notice
+from pipelinepackage.eformsprocessingmodule import extract_awarded_contracts, extract_contracting_authority
+from pipelinepackage.eformsprocessingmodule import index_organizations
+
+LARGEST_NOTICES = 10
+SYNTHETIC_LOTS = 500
+REPEAT = 3
+NUMBER = 5
+
+
+# -------------------------------- FORMER IMPLEMENTATION --------------------------------
+def former_get_organization_data(id, all_organizations):
+    try:
+        organization = {}
+        if isinstance(all_organizations, dict):
+            all_organizations = [all_organizations]
+        for org in all_organizations:
+            if org["efac:Company"]["cac:PartyIdentification"]["cbc:ID"] == id:
+                organization = org["efac:Company"]
+                continue
+        name = organization.get("cac:PartyName", {}) #Apparently there can be multiple names
+        natid = organization.get("cac:PartyLegalEntity", {}) #And IDs
+        if isinstance(name, list):
+            name = name[0]
+        if isinstance(natid, list):
+            natid = natid[0]
+        return {
+            "Name": name.get("cbc:Name", "-"),
+            "National ID": natid.get("cbc:CompanyID", -1),
+            "Address": {
+                "Country": organization.get("cac:PostalAddress", {}).get("cac:Country", {}).get(
+                    "cbc:IdentificationCode", "-"),
+                "Town": organization.get("cac:PostalAddress", {}).get("cbc:CityName", "-"),
+                "Postal Code": organization.get("cac:PostalAddress", {}).get("cbc:PostalZone", "-"),
+                "Address": organization.get("cac:PostalAddress", {}).get("cbc:StreetName", "-"),
+                "Territorial Unit (NUTS3)": organization.get("cac:PostalAddress", {}).get(
+                    "cbc:CountrySubentityCode", "-")
+            },
+            "Contact": {
+                "URL": organization.get("cbc:WebsiteURI", "-"),
+                "Email": organization.get("cac:Contact", {}).get("cbc:Telephone", "-"),
+                "Phone": organization.get("cac:Contact", {}).get("cbc:ElectronicMail", "-")
+            }
+        }
+    except KeyError:
+        return {}
+
+
+def former_extract_contracting_authority(cparty, organizations):
+    cparty_id = cparty.get("cac:PartyIdentification", {}).get("cbc:ID", "-")
+    cparty_data = former_get_organization_data(cparty_id, organizations)
+    cparty_data["Activity"] = cparty.get("cac:ContractingActivity",{}).get("cbc:ActivityTypeCode","-")
+    cparty_types = cparty.get("cac:ContractingActivity",[])
+    if isinstance(cparty_types, dict):
+        cparty_types = [cparty_types]
+    cparty_data["CA Type"] = [type.get("cbc:PartyTypeCode","-") for type in cparty_types]
+    return cparty_data
+
+
+def former_extract_awarded_contracts(extensions):
+    result = extensions.get("efac:NoticeResult",{})
+    all_lot_results = result.get("efac:LotResult",[])
+    if isinstance(all_lot_results, dict):
+        all_lot_results = [all_lot_results]
+
+    all_settled_contracts = result.get("efac:SettledContract",[])
+    if isinstance(all_settled_contracts, dict):
+        all_settled_contracts = [all_settled_contracts]
+
+    all_lot_tenders = result.get("efac:LotTender", [])
+    if isinstance(all_lot_tenders, dict):
+        all_lot_tenders = [all_lot_tenders]
+
+    all_tendering_parties = result.get("efac:TenderingParty", [])
+    if isinstance(all_tendering_parties, dict):
+        all_tendering_parties = [all_tendering_parties]
+
+    all_organizations = extensions.get("efac:Organizations", {})
+    all_organizations = all_organizations.get("efac:Organization",[])
+    if isinstance(all_organizations, dict):
+        all_organizations = [all_organizations]
+
+    awards = []
+    date_conclusion = None
+    aw_title = "-"
+    for lot_result in all_lot_results:
+        contractors_info = []
+        contractid =  lot_result.get("efac:SettledContract",{})
+        if isinstance(contractid, list): # apparently a lot result can have multiple associated contracts, what do they mean I do not know. Documentation is completely lacking so I will ignore these results.
+            contractid = contractid[0]
+        sett_contract = [contract for contract in all_settled_contracts if contract["cbc:ID"] ==contractid.get("cbc:ID")]
+        if sett_contract:
+            sett_contract = sett_contract[0]
+            lot_tenders = sett_contract.get("efac:LotTender", {})
+            aw_title = sett_contract.get("cbc:Title", "-")
+            date_conclusion = sett_contract.get("cbc:IssueDate", None)
+            try:
+                if date_conclusion is not None:
+                    date_conclusion = datetime.strptime(date_conclusion, "%Y-%m-%d%z")
+            except ValueError:
+                date_conclusion = None  # Handle parsing errors
+        else: #Alternative route, there may not be settled contracts in the extensions but the link is made through LotTender directly
+            lot_tenders = lot_result.get("efac:LotTender",{})
+
+        if lot_tenders: #This in reality should take the tenderresultcode instead!!
+            if isinstance(lot_tenders, dict):
+                lot_tenders = [lot_tenders]
+            for lot_tender in lot_tenders:
+                lot_tender = [lt for lt in all_lot_tenders if lt["cbc:ID"] == lot_tender["cbc:ID"]]
+                lot_tender = lot_tender[0] if lot_tender else {}
+                tendering_party = [tpa for tpa in all_tendering_parties if tpa["cbc:ID"] == lot_tender["efac:TenderingParty"]["cbc:ID"]]
+                tendering_party = tendering_party[0] if tendering_party else {}
+
+                org_list = tendering_party.get("efac:Tenderer",[])
+                if isinstance(org_list, dict):
+                    org_list = [org_list]
+                for org in org_list:
+                    search_id = org.get("cbc:ID",-1)
+                    new_org = former_get_organization_data(search_id, all_organizations)
+                    contractors_info.append(new_org)
+        statistics = lot_result.get("efac:ReceivedSubmissionsStatistics", [])
+        if statistics:
+            if isinstance(statistics, dict):
+                number_of_tenders = statistics.get("efbc:StatisticsNumeric",-1) #Apparently there can be a dict instead of a list and then there is no code, just default tender number
+            else:
+                if all("efbc:StatisticsCode" in stat.keys() for stat in statistics):
+                    stat_tenders = [stat for stat in statistics if stat["efbc:StatisticsCode"] == "tenders"]
+                    if stat_tenders:
+                        stat_tenders = stat_tenders[-1]
+                        number_of_tenders = stat_tenders.get("efbc:StatisticsNumeric",-1)
+                    else:
+                        number_of_tenders = -1
+                else: #Yes, there may be a list with multiple and contradicting entries, AND unlabelled. I will get the latest entry.
+                    number_of_tenders = statistics[-1].get("efbc:StatisticsNumeric",-1)
+        else:
+            number_of_tenders = -1
+
+
+        aw_info = {
+            "Awarded Contract Title": aw_title,
+            "Corresponding Lot": lot_result.get("efac:TenderLot", {}).get("cbc:ID", "-"),
+            "Number of Tenders": number_of_tenders,
+            "Contractors": contractors_info,
+            "Conclusion Date": date_conclusion
+        }
+        awards.append(aw_info)
+    return awards
+
+
+# -------------------------------- NOTICES --------------------------------
+def synthetic_framework(lots):
+    organizations = [{"efac:Company": {"cac:PartyIdentification": {"cbc:ID": f"ORG-{i:04}"},
+                                       "cac:PartyName": {"cbc:Name": f"Company {i}"},
+                                       "cac:PostalAddress": {"cbc:CityName": "Madrid",
+                                                             "cac:Country": {"cbc:IdentificationCode": "ESP"}}}}
+                     for i in range(lots + 1)]  # ORG-0000 is the buyer
+    return {
+        "cac:ContractingParty": {"cac:Party": {"cac:PartyIdentification": {"cbc:ID": "ORG-0000"}}},
+        "ext:UBLExtensions": {"ext:UBLExtension": {"ext:ExtensionContent": {"efext:EformsExtension": {
+            "efac:NoticeResult": {
+                "efac:LotResult": [{"cbc:ID": f"RES-{i:04}", "efac:SettledContract": {"cbc:ID": f"CON-{i:04}"},
+                                    "efac:TenderLot": {"cbc:ID": f"LOT-{i:04}"},
+                                    "efac:ReceivedSubmissionsStatistics": {"efbc:StatisticsNumeric": "3"}}
+                                   for i in range(1, lots + 1)],
+                "efac:LotTender": [{"cbc:ID": f"TEN-{i:04}", "efac:TenderingParty": {"cbc:ID": f"TPA-{i:04}"}}
+                                   for i in range(1, lots + 1)],
+                "efac:SettledContract": [{"cbc:ID": f"CON-{i:04}", "cbc:Title": f"Contract {i}",
+                                          "cbc:IssueDate": "2024-01-02+01:00",
+                                          "efac:LotTender": {"cbc:ID": f"TEN-{i:04}"}}
+                                         for i in range(1, lots + 1)],
+                "efac:TenderingParty": [{"cbc:ID": f"TPA-{i:04}", "efac:Tenderer": {"cbc:ID": f"ORG-{i:04}"}}
+                                        for i in range(1, lots + 1)],
+            },
+            "efac:Organizations": {"efac:Organization": organizations}}}}},
+    }
+
+
+def notice_files(paths):
+    files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            files.append(path)
+            continue
+        found = [os.path.join(root, name) for root, _, names in os.walk(path) for name in names
+                 if name.endswith(".xml")]
+        files += sorted(found, key=os.path.getsize, reverse=True)[:LARGEST_NOTICES]
+    return files
+
+
+def load_notices(paths):
+    notices = []
+    for path in notice_files(paths):
+        with open(path, 'rb') as file:
+            status, is_eforms, notice_id, notice, error = process_notice(file.read())
+        if status == 'success' and is_eforms:  # The _source of the notice in ted-eforms
+            notices.append((f"{notice_id} ({os.path.getsize(path) // 1024} KB)", notice))
+    return notices
+
+
+def extract(notice, awarded_contracts, contracting_authority, index=None):
+    """Awards and contracting authorities of a notice, as processing-pipeline-eforms extracts them."""
+    extensions = notice["ext:UBLExtensions"]["ext:UBLExtension"]["ext:ExtensionContent"]["efext:EformsExtension"]
+    organizations = extensions["efac:Organizations"]["efac:Organization"]
+    if index is not None:
+        organizations = index(organizations)
+    cparties = notice.get("cac:ContractingParty", {})
+    if isinstance(cparties, dict):
+        cparties = [cparties]
+    authorities = [contracting_authority(ca.get("cac:Party", {}), organizations) for ca in cparties]
+    if index is not None:
+        return awarded_contracts(extensions, organizations), authorities
+    return awarded_contracts(extensions), authorities
+
+
+# -------------------------------- CODE --------------------------------
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        notices = load_notices(sys.argv[1:])
+    else:
+        notices = [(f"synthetic framework ({SYNTHETIC_LOTS} lots)", synthetic_framework(SYNTHETIC_LOTS))]
+    for name, notice in notices:
+        former = lambda: extract(notice, former_extract_awarded_contracts, former_extract_contracting_authority)
+        current = lambda: extract(notice, extract_awarded_contracts, extract_contracting_authority, index_organizations)
+        if former() != current():
+            sys.exit(f"{name}: the extracted awards differ")
+        for label, function in (("scans", former), ("indexes", current)):
+            times = timeit.repeat(function, repeat=REPEAT, number=NUMBER)
+            print(f"{name:40} {label:8} {min(times) / NUMBER * 1000:10.3f} ms per notice")
@@ -0,0 +1,161 @@
+#Micro-benchmark of the notice normaliser (xmlmodule.normalise_notice) against the former recursive implementation.
+#Usage: python3 pipeline/benchmark-normaliser.py [notice.xml ...]
+#Without arguments, large synthetic F03 and eForms notices are generated. Both implementations must give the same documents.
+import copy
+import sys
+import timeit
+from pipelinepackage.xmlmodule import normalise_notice, parse_notice
+
+REPEAT = 15
+NUMBER = 20
+SYNTHETIC_LOTS = 500  # Lots (F03) and awarded contracts (eForms) of the synthetic notices
+
+
+# -------------------------------- FORMER IMPLEMENTATION --------------------------------
+def modify_p_fields(dictionary):
+    if isinstance(dictionary, dict):
+        for text_field, text_dictionary in dictionary.items():
+            if isinstance(text_dictionary, dict):
+                for p_field, p_value in text_dictionary.items():
+                    if p_field == 'P':
+                        dictionary[text_field] = fetch_p_text(p_value)
+                    else:
+                        modify_p_fields(text_dictionary)
+            elif isinstance(text_dictionary, list):
+                modify_p_fields(text_dictionary)
+    elif isinstance(dictionary, list):
+        for e in range(len(dictionary)):
+            if isinstance(dictionary[e], dict):
+                modify_p_fields(dictionary[e])
+
+
+def fetch_p_text(p_dictionary):
+    if p_dictionary is None:
+        return ""
+    elif isinstance(p_dictionary, str):
+        return p_dictionary
+    elif isinstance(p_dictionary, list):
+        p_text = ""
+        for item in p_dictionary:
+            p_text = p_text + "\n" + fetch_p_text(item)
+        return p_text[1:]
+    elif isinstance(p_dictionary, dict):
+        if "#text" in p_dictionary:
+            return p_dictionary["#text"]
+        else:
+            p_text = ""
+            for inner_field, inner_dictionary in p_dictionary.items():
+                p_text = p_text + "; " + fetch_p_text(inner_dictionary)
+            return p_text[2:]
+
+
+def modify_txt_fields(dictionary):
+    if isinstance(dictionary, dict):
+        for k, v in dictionary.items():
+            if isinstance(v, dict):
+                if '#text' in v.keys():
+                    dictionary[k] = dictionary[k]['#text']
+                else:
+                    modify_txt_fields(v)
+            elif isinstance(v, list):
+                for e in range(len(v)):
+                    if isinstance(v[e], dict):
+                        if '#text' in v[e].keys():
+                            dictionary[k] = v[e]['#text']
+                        else:
+                            modify_txt_fields(v[e])
+    elif isinstance(dictionary, list):
+        for e in range(len(dictionary)):
+            modify_txt_fields(dictionary[e])
+
+
+def former_legacy(notice):
+    modify_p_fields(notice)
+    return notice
+
+
+def former_eforms(notice):
+    modify_txt_fields(notice)
+    return {k: v for k, v in notice.items() if not k.startswith('@')}
+
+
+# -------------------------------- NOTICES --------------------------------
+def synthetic_f03(lots):
+    paragraphs = {"P": [f"Paragraph {i} of a long description with some text." for i in range(10)]}
+    return {
+        "CODED_DATA_SECTION": {"NOTICE_DATA": {"NO_DOC_OJS": "2023/S 001-000001", "URI_LIST": {"URI_DOC": [
+            {"@LG": lg, "#text": f"https://ted.europa.eu/{lg}"} for lg in ("EN", "FR", "DE", "ES")]}}},
+        "CONTRACT_AWARD_NOTICE": {
+            "@LG": "EN",
+            "OBJECT_CONTRACT": {
+                "TITLE": {"P": "Title"},
+                "SHORT_DESCR": copy.deepcopy(paragraphs),
+                "OBJECT_DESCR": [{"@ITEM": str(i), "TITLE": {"P": f"Lot {i}"},
+                                  "SHORT_DESCR": copy.deepcopy(paragraphs),
+                                  "AC": {"AC_CRITERION": {"P": [{"#text": "Price", "FT": {"@TYPE": "SUP", "#text": "1"}}]}}}
+                                 for i in range(lots)],
+            },
+            "AWARD_CONTRACT": [{"@ITEM": str(i), "LOT_NO": str(i), "AWARDED_CONTRACT": {
+                "CONTRACTORS": {"CONTRACTOR": {"ADDRESS_CONTRACTOR": {"OFFICIALNAME": f"Company {i}", "TOWN": "Madrid"}}},
+                "VALUES": {"VAL_TOTAL": {"@CURRENCY": "EUR", "#text": "1000"}}}} for i in range(lots)],
+            "COMPLEMENTARY_INFO": {"INFO_ADD": {"P": ["Additional", {"FT": "text"}, None]}},
+        }
+    }
+
+
+def synthetic_eforms(lots):
+    return {
+        "@xmlns": "urn:oasis:names:specification:ubl:schema:xsd:ContractAwardNotice-2",
+        "@xmlns:cbc": "urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2",
+        "cbc:ID": {"@schemeName": "notice-id", "#text": "0000-0000"},
+        "ext:UBLExtensions": {"ext:UBLExtension": {"ext:ExtensionContent": {"efext:EformsExtension": {
+            "efac:Publication": {"efbc:NoticePublicationID": {"@schemeName": "ojs-notice-id", "#text": "00000001-2023"}},
+            "efac:NoticeResult": {
+                "efac:LotTender": [{"cbc:ID": {"@schemeName": "tender", "#text": f"TEN-{i:04}"},
+                                    "cac:LegalMonetaryTotal": {"cbc:PayableAmount": {"@currencyID": "EUR", "#text": "1000"}}}
+                                   for i in range(lots)],
+                "efac:SettledContract": [{"cbc:ID": {"@schemeName": "contract", "#text": f"CON-{i:04}"},
+                                          "efac:LotTender": {"cbc:ID": {"@schemeName": "tender", "#text": f"TEN-{i:04}"}}}
+                                         for i in range(lots)],
+            },
+            "efac:Organizations": {"efac:Organization": [{"efac:Company": {
+                "cac:PartyName": {"cbc:Name": [{"@languageID": "ENG", "#text": f"Company {i}"},
+                                               {"@languageID": "FRA", "#text": f"Entreprise {i}"}]},
+                "cac:PostalAddress": {"cbc:CityName": "Madrid", "cac:Country": {"cbc:IdentificationCode": {
+                    "@listName": "country", "#text": "ESP"}}}}} for i in range(lots)]}}}}},
+        "cac:ProcurementProject": {"cbc:Description": [{"@languageID": "ENG", "#text": "Description"}]},
+    }
+
+
+def load_notice(path):
+    notice = parse_notice(path, "xmltodict")
+    if "TED_EXPORT" in notice:
+        notice = notice["TED_EXPORT"]
+        return "F03 " + path, False, {"CODED_DATA_SECTION": notice["CODED_DATA_SECTION"],
+                                      "CONTRACT_AWARD_NOTICE": notice["FORM_SECTION"]["F03_2014"]}
+    return "eForms " + path, True, notice["ContractAwardNotice"]
+
+
+# -------------------------------- CODE --------------------------------
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        notices = [load_notice(path) for path in sys.argv[1:]]
+    else:
+        notices = [("synthetic F03", False, synthetic_f03(SYNTHETIC_LOTS)),
+                   ("synthetic eForms", True, synthetic_eforms(SYNTHETIC_LOTS))]
+    for name, is_eforms, notice in notices:
+        if is_eforms:
+            former = former_eforms
+            current = lambda n: normalise_notice(n, collapse_text=True, strip_root_attributes=True)
+        else:
+            former = former_legacy
+            current = lambda n: normalise_notice(n, flatten_p=True)
+        if former(copy.deepcopy(notice)) != current(copy.deepcopy(notice)):
+            sys.exit(f"{name}: the normalised documents differ")
+        times = {"recursive": [], "iterative": []}
+        for _ in range(REPEAT):  # Alternated, so both implementations see the same load of the host
+            for label, function in (("recursive", former), ("iterative", current)):
+                copies = [copy.deepcopy(notice) for _ in range(NUMBER)]
+                times[label].append(timeit.timeit(lambda: function(copies.pop()), number=NUMBER))
+        for label, label_times in times.items():
+            print(f"{name:20} {label:10} {min(label_times) / NUMBER * 1000:8.3f} ms per notice")
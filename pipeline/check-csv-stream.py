@@ -0,0 +1,72 @@
+#Check of the streaming CSV read (csvmodule.iter_csv_notices) against read_csvs on exports whose notices are not
+#contiguous: rows of a notice appearing again later in the file must fill its missing values as groupby().first() does.
+#Usage: python3 pipeline/check-csv-stream.py [csv folder]
+#Without arguments, a synthetic export of SYNTHETIC_NOTICES notices is generated, a LATE_SHARE of their lots being
+#moved up to LATE_DISTANCE rows later in the file. Read with small blocks and batches, so late rows cross both.
+import csv
+import os
+import random
+import sys
+import tempfile
+import pandas as pd
+from pipelinepackage.csvmodule import read_csvs, iter_csv_notices, COLUMNS_CAN_LEVEL, DTYPES, BOOL_COLS, INT_COLS
+
+SYNTHETIC_NOTICES = 20000
+LATE_SHARE = 0.1
+LATE_DISTANCE = 3000
+BLOCK_SIZE = 2**18  # Bytes per CSV block
+BATCH_SIZE = 5000  # Notices per yielded batch, also the window in which late rows are combined
+
+
+# -------------------------------- DATA --------------------------------
+def synthetic_value(col, first_lot):
+    if col in BOOL_COLS:
+        return random.choice(['Y', 'N', ''])
+    if col in INT_COLS:
+        return random.choice(['', '45000000', '3'])
+    if col == 'LOTS_NUMBER':
+        return random.choice(['', '1', '12'])
+    if col == 'DT_DISPATCH':
+        return f"{random.randint(1, 28):02}/{random.randint(1, 12):02}/23"
+    if col == 'CANCELLED':
+        return random.choice(['0', '1'])
+    if first_lot and random.random() < 0.5:  # Missing in the first lot, to be filled by a later one
+        return ''
+    if DTYPES.get(col) == 'float':
+        return random.choice(['', '1520.5', '100000'])
+    return random.choice(['', 'Ayuntamiento de Madrid', 'ES', 'UK'])
+
+
+def write_synthetic_csv(file_path, notices):
+    rows = []
+    for i in range(notices):
+        for lot in range(random.randint(1, 3)):
+            row = [f"2023{i}" if col == 'ID_NOTICE_CAN' else synthetic_value(col, lot == 0) for col in COLUMNS_CAN_LEVEL]
+            rows.append(row + [lot + 1])
+    for position in random.sample(range(len(rows)), int(len(rows) * LATE_SHARE)):  # Lots moved later in the file
+        target = min(len(rows) - 1, position + random.randint(1, LATE_DISTANCE))
+        rows.insert(target, rows.pop(position))
+    with open(file_path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(COLUMNS_CAN_LEVEL + ['ID_LOT'])
+        writer.writerows(rows)
+
+
+# -------------------------------- CODE --------------------------------
+if __name__ == "__main__":
+    temp_folder = None
+    if len(sys.argv) > 1:
+        folder = sys.argv[1]
+    else:
+        random.seed(0)
+        temp_folder = tempfile.TemporaryDirectory()
+        folder = temp_folder.name
+        write_synthetic_csv(os.path.join(folder, "export_CAN_2023.csv"), SYNTHETIC_NOTICES)
+    expected = read_csvs(folder)
+    streamed = pd.concat(iter_csv_notices(folder, batch_size=BATCH_SIZE, block_size=BLOCK_SIZE))
+    if temp_folder is not None:
+        temp_folder.cleanup()
+    if streamed.index.has_duplicates:
+        sys.exit(f"{int(streamed.index.duplicated().sum())} notices were yielded more than once")
+    pd.testing.assert_frame_equal(expected.sort_index(), streamed.sort_index(), check_dtype=False)
+    print(f"{len(streamed)} notices: the streamed notices match read_csvs")
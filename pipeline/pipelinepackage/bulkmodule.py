@@ -0,0 +1,304 @@
+#This module groups the helpers to send bulk requests to opensearch.
+from opensearchpy.exceptions import TransportError, NotFoundError
+from opensearchpy.helpers.actions import expand_action
+from opensearchpy.serializer import JSONSerializer
+from concurrent.futures import ThreadPoolExecutor, wait
+from time import sleep, monotonic
+import threading
+import atexit
+import json
+import os
+import numpy as np
+import pandas as pd
+
+BULK_STATE_FOLDER = "./logs/bulk-load/"  # Original settings of the indexes in bulk-load mode, until they are restored
+BULK_SETTINGS = ("index.refresh_interval", "index.number_of_replicas")
+_SERIALIZER = JSONSerializer()  # Fallback for the values json does not know (nested dates, numpy scalars)
+
+
+def column_values(series):
+    """
+    Values of a DataFrame column as a plain python list, taken from the column at once: missing values (NaN, NaT,
+    NA, None) become None and dates their ISO string, as the opensearch serializer writes them.
+    """
+    if series.dtype.kind == 'M':
+        return [None if value is pd.NaT else value.isoformat() for value in series.tolist()]
+    values = series.tolist()
+    if isinstance(series.dtype, np.dtype) and series.dtype.kind in 'biu':  # Numpy ints and bools can not be missing
+        return values
+    missing = series.isna().to_numpy()
+    if missing.any():
+        for position in np.flatnonzero(missing):
+            values[position] = None
+    return values
+
+
+def _frame_rows(df, id_column):
+    columns = [column for column in df.columns if column != id_column]
+    ids = column_values(df[id_column]) if id_column is not None else df.index.tolist()
+    return columns, ids, zip(*(column_values(df[column]) for column in columns))
+
+
+def frame_actions(df, index, id_column=None, op_type="index"):
+    """
+    Bulk actions (dicts for helpers.bulk, helpers.streaming_bulk or BulkIndexer) with one document per row of df,
+    built column-wise instead of with iterrows. The field names are the column names, the _id is taken from
+    id_column (not indexed as a field) or from the DataFrame index.
+    """
+    columns, ids, rows = _frame_rows(df, id_column)
+    for doc_id, row in zip(ids, rows):
+        action = dict(zip(columns, row))
+        action["_op_type"] = op_type
+        action["_index"] = index
+        action["_id"] = doc_id
+        yield action
+
+
+def frame_ndjson(df, index, id_column=None, op_type="index"):
+    """
+    Same documents as frame_actions, already serialized as (action line, source line) NDJSON pairs. They are sent
+    as they are by BulkIndexer.add and by helpers.bulk/streaming_bulk with expand_action_callback=expand_serialized.
+    """
+    columns, ids, rows = _frame_rows(df, id_column)
+    for doc_id, row in zip(ids, rows):
+        yield _ndjson_pair(index, doc_id, dict(zip(columns, row)), op_type)
+
+
+def record_ndjson(records, index, op_type="index"):
+    """
+    Same (action line, source line) pairs as frame_ndjson, for records (e.g. scanmodule.ProcessedNotice) giving their
+    _id as record.doc_id and their document as record.document(). They are serialized one at a time as they are
+    produced, with no DataFrame in between.
+    """
+    for record in records:
+        yield _ndjson_pair(index, record.doc_id, record.document(), op_type)
+
+
+def _ndjson_pair(index, doc_id, source, op_type):
+    return (json.dumps({op_type: {"_index": index, "_id": doc_id}}, default=_SERIALIZER.default,
+                       separators=(",", ":")),
+            json.dumps(source, default=_SERIALIZER.default, ensure_ascii=False, separators=(",", ":")))
+
+
+def expand_serialized(action):
+    """expand_action_callback of the helpers for the pairs of frame_ndjson (the serializer leaves strings as is)."""
+    return action
+
+
+class BulkIndexer:
+    """
+    Buffers bulk actions (same dicts as for helpers.bulk, or the pairs of frame_ndjson) and sends each of them once,
+    in requests sized by serialized payload bytes instead of by number of documents.
+    The request size adapts to the cluster: it grows while requests answer within target_latency and shrinks when
+    they are slower or when items are rejected with 429. Rejected items are resent after an exponential backoff.
+    Requests are sent from add(), synchronously or with up to max_in_flight requests running in threads. add() waits
+    while all of them are in flight, so a slow or saturated cluster slows down the producer instead of being flooded
+    (no fixed sleeps between requests). flush() sends the buffered actions and waits for every request in flight.
+    on_result(index, doc_id, ok, error) is called once for every action when its outcome is known, one call at a time.
+    """
+    def __init__(self, client, batch_bytes=5 * 2**20, min_bytes=2**20, max_bytes=20 * 2**20, target_latency=2.0,
+                 max_retries=5, initial_backoff=2, max_backoff=120, on_result=None, max_in_flight=1):
+        self.client = client
+        self.serializer = client.transport.serializer
+        self.batch_bytes = batch_bytes
+        self.min_bytes = min_bytes
+        self.max_bytes = max_bytes
+        self.target_latency = target_latency
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.on_result = on_result
+        self.buffer = []  # (index, doc_id, ndjson lines) of the pending actions
+        self.buffer_bytes = 0
+        self.success = 0
+        self.failed = 0
+        self.lock = threading.Lock()  # Counters, request size and on_result are shared by the request threads
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight) if max_in_flight > 1 else None
+        self.slots = threading.BoundedSemaphore(max_in_flight)
+        self.in_flight = set()
+        self.failed_requests = set()  # Requests stopped by an unexpected exception, raised by flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def add(self, action):
+        if isinstance(action, tuple):  # Serialized (action line, source line) pair of frame_ndjson
+            op = json.loads(action[0])
+            lines = action[0] + "\n" + action[1] + "\n"
+        else:
+            op, source = expand_action(action)
+            lines = self.serializer.dumps(op) + "\n"
+            if source is not None:
+                lines += self.serializer.dumps(source) + "\n"
+        meta = op[next(iter(op))]
+        lines = lines.encode("utf-8")
+        self.buffer.append((meta.get("_index"), meta.get("_id"), lines))
+        self.buffer_bytes += len(lines)
+        if self.buffer_bytes >= self.batch_bytes:
+            self._submit()
+
+    def flush(self):
+        self._submit()
+        futures = list(self.in_flight)
+        wait(futures)
+        failed = self.failed_requests.union(future for future in futures if future.exception() is not None)
+        self.failed_requests = set()
+        if failed:  # Raised as it would be by a synchronous request
+            raise next(iter(failed)).exception()
+
+    def close(self):
+        self.flush()
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def _submit(self):
+        items = self.buffer
+        self.buffer = []
+        self.buffer_bytes = 0
+        if not items:
+            return
+        if self.executor is None:
+            self._send_items(items)
+            return
+        self.slots.acquire()  # Waits for a request in flight to complete
+        future = self.executor.submit(self._send_items, items)
+        self.in_flight.add(future)
+        future.add_done_callback(self._release)
+
+    def _release(self, future):
+        if future.exception() is not None:
+            self.failed_requests.add(future)
+        self.in_flight.discard(future)
+        self.slots.release()
+
+    def _send_items(self, items):
+        attempt = 0
+        while items:
+            start = monotonic()
+            try:
+                response = self.client.bulk(body=b"".join(lines for _, _, lines in items))
+            except TransportError as e:
+                retryable = e.status_code in (429, 'N/A')  # Rejected or connection error (timeout, reset)
+                if not retryable or attempt >= self.max_retries:
+                    self._report_all(items, f"Bulk request failed: {e}")
+                    return
+                self._resize(rejected=True)
+                attempt = self._backoff(attempt, f"Bulk request rejected ({e.status_code})")
+                continue
+            latency = monotonic() - start
+            rejected = []
+            for item, result in zip(items, response["items"]):
+                result = result[next(iter(result))]
+                status = result.get("status", 200)
+                if status == 429 and attempt < self.max_retries:
+                    rejected.append(item)
+                elif status >= 300:
+                    self._report(item, False, result.get("error", {}).get("reason", str(result.get("error"))))
+                else:
+                    self._report(item, True, None)
+            self._resize(rejected=bool(rejected), latency=latency)
+            items = rejected
+            if items:
+                attempt = self._backoff(attempt, f"{len(items)} bulk items rejected (429)")
+
+    def _backoff(self, attempt, reason):
+        delay = min(self.max_backoff, self.initial_backoff * 2 ** attempt)
+        print(f"{reason}, retrying in {delay}s (attempt {attempt + 1})")
+        sleep(delay)
+        return attempt + 1
+
+    def _resize(self, rejected, latency=None):
+        with self.lock:
+            if rejected or (latency is not None and latency > self.target_latency):
+                self.batch_bytes = max(self.min_bytes, self.batch_bytes // 2)
+            elif latency is not None and latency < self.target_latency / 2:
+                self.batch_bytes = min(self.max_bytes, int(self.batch_bytes * 1.25))
+
+    def _report(self, item, ok, error):
+        index, doc_id, _ = item
+        with self.lock:
+            if ok:
+                self.success += 1
+            else:
+                self.failed += 1
+                print(f"Failed to index {doc_id} in {index}: {error}")
+            if self.on_result is not None:
+                self.on_result(index, doc_id, ok, error)
+
+    def _report_all(self, items, error):
+        for item in items:
+            self._report(item, False, error)
+
+
+class BulkLoadMode:
+    """
+    Bulk-load settings of an index for the duration of a load: no periodic refresh (refresh_interval -1) and, with
+    drop_replicas=True, no replicas. Used as a context manager, or with start()/finish() in flat scripts.
+    The original settings are saved to <state_folder>/<index>.json before they are changed. They are restored,
+    followed by a single refresh, by finish(), or at interpreter exit when finish() is not reached. A state file left
+    by a killed run is restored when the next one starts.
+    """
+    def __init__(self, client, index, drop_replicas=False, state_folder=BULK_STATE_FOLDER):
+        self.client = client
+        self.index = index
+        self.drop_replicas = drop_replicas
+        self.state_path = os.path.join(state_folder, f"{index}.json")
+        self.active = False
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.finish()
+
+    def start(self):
+        if self.active:
+            return self
+        self.restore()  # Settings left by a run that was killed
+        if not self.client.indices.exists(index=self.index):
+            print(f"Index {self.index} does not exist yet, it is loaded with its default settings")
+            return self
+        response = self.client.indices.get_settings(index=self.index, flat_settings=True)
+        original = {name: {key: index_settings["settings"].get(key) for key in BULK_SETTINGS}
+                    for name, index_settings in response.items()}  # None: not set, restored to the default
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        with open(self.state_path + ".tmp", 'w', encoding='utf-8') as file:
+            json.dump(original, file)
+        os.replace(self.state_path + ".tmp", self.state_path)
+        settings = {"index.refresh_interval": "-1"}
+        if self.drop_replicas:
+            settings["index.number_of_replicas"] = 0
+        self.active = True
+        atexit.register(self.finish)
+        self.client.indices.put_settings(index=",".join(original), body=settings)
+        return self
+
+    def finish(self):
+        if not self.active:
+            return
+        self.active = False
+        atexit.unregister(self.finish)
+        try:
+            if self.restore():
+                self.client.indices.refresh(index=self.index)
+        except Exception as e:
+            print(f"Could not restore the settings of {self.index}, they are restored on the next run: {e}")
+
+    def restore(self):
+        """Puts back the settings saved in the state file, if any. Returns whether there was something to restore."""
+        if not os.path.exists(self.state_path):
+            return False
+        with open(self.state_path, 'r', encoding='utf-8') as file:
+            original = json.load(file)
+        for name, settings in original.items():
+            try:
+                self.client.indices.put_settings(index=name, body=settings)
+            except NotFoundError:
+                pass  # Index deleted in the meantime
+        os.remove(self.state_path)
+        print(f"Restored the settings of {', '.join(original)}")
+        return True
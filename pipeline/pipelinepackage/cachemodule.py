@@ -0,0 +1,220 @@
+#This module groups the local store of TED daily packages, so reprocessing a package does not download it again.
+from datetime import datetime as dt
+import urllib.request
+import urllib.error
+import hashlib
+import json
+import os
+from pipelinepackage.packagemodule import is_local, package_url, open_package
+
+CHUNK_SIZE = 2**20  # Bytes copied at a time when checksumming or draining a download
+
+
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def _read_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path, data):
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(data, file)
+    os.replace(temp_path, path)
+
+
+class PackageCache:
+    """
+    Local store of the packages, kept as <folder>/<year>/<ojs>.tar.gz next to a .json file with the checksum
+    (sha256), size and HTTP validators (ETag, Last-Modified) of the archive.
+    - Archives are only downloaded once. With revalidate=True a cached archive is checked with a conditional request
+      (304 means it is still valid), and used as is when the server can not be reached.
+    - Downloads are written to a .part file and resumed with a Range request after an interruption.
+    - With a local base_url (mirror mode, e.g. the folder of another cache) no request is made at all.
+    """
+    def __init__(self, folder, base_url, revalidate=True, verify=True, timeout=60):
+        self.folder = folder
+        self.base_url = base_url
+        self.revalidate = revalidate
+        self.verify = verify
+        self.timeout = timeout
+
+    def archive_path(self, year, ojs):
+        return os.path.join(self.folder, str(year), f"{str(ojs).zfill(5)}.tar.gz")
+
+    def fetch(self, year, ojs):
+        """Path of the cached archive of a package, downloaded first when needed."""
+        if is_local(self.base_url):
+            url = package_url(self.base_url, year, ojs)
+            open_package(url).close()  # Raises HTTPError 404 when the mirror does not have the package
+            return url
+        with self.open(year, ojs) as reader:
+            if isinstance(reader, _CachingReader):
+                reader.drain()
+        return self.archive_path(year, ojs)
+
+    def open(self, year, ojs):
+        """
+        Binary file object with the archive of a package: the cached file, or the download itself, which is written
+        to the cache while it is read. Raises urllib.error.HTTPError as open_package (404 when not published).
+        """
+        url = package_url(self.base_url, year, ojs)
+        if is_local(self.base_url):
+            return open_package(url, timeout=self.timeout)
+        path = self.archive_path(year, ojs)
+        metadata = self._cached_metadata(path)
+        if metadata is not None and not self.revalidate:
+            return open(path, 'rb')
+
+        part_path = path + ".part"
+        part_metadata = _read_json(part_path + ".json") if os.path.exists(part_path) else None
+        headers = {}
+        if metadata is not None:
+            if metadata.get('etag'):
+                headers['If-None-Match'] = metadata['etag']
+            if metadata.get('last_modified'):
+                headers['If-Modified-Since'] = metadata['last_modified']
+        elif part_metadata is not None and (part_metadata.get('etag') or part_metadata.get('last_modified')):
+            headers['Range'] = f"bytes={os.path.getsize(part_path)}-"
+            headers['If-Range'] = part_metadata.get('etag') or part_metadata['last_modified']
+        try:
+            response = urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            if e.code == 304 and metadata is not None:
+                return open(path, 'rb')
+            if e.code == 416:  # Stale partial download
+                self._remove_part(part_path)
+                return self.open(year, ojs)
+            raise
+        except (urllib.error.URLError, OSError) as e:
+            if metadata is None:
+                raise
+            print(f"Could not revalidate {url} ({e}), using the cached archive")
+            return open(path, 'rb')
+
+        resume = 'Range' in headers and response.status == 206
+        if resume and not response.headers.get('Content-Range', '').startswith(f"bytes {os.path.getsize(part_path)}-"):
+            response.close()
+            self._remove_part(part_path)
+            return self.open(year, ojs)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return _CachingReader(response, url, path, part_path, resume)
+
+    def remove(self, year, ojs):
+        """Removes a package from the cache (not from a local mirror)."""
+        if is_local(self.base_url):
+            return
+        path = self.archive_path(year, ojs)
+        for file_path in (path, path + ".json"):
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+    def _cached_metadata(self, path):
+        """Metadata of a cached archive, None when it is missing or does not match its size or checksum."""
+        metadata = _read_json(path + ".json")
+        if metadata is None or not os.path.exists(path):
+            return None
+        if os.path.getsize(path) != metadata['size'] or (self.verify and file_sha256(path) != metadata['sha256']):
+            print(f"Cached archive {path} is corrupted, downloading it again")
+            return None
+        return metadata
+
+    @staticmethod
+    def _remove_part(part_path):
+        for file_path in (part_path, part_path + ".json"):
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+
+class _CachingReader:
+    """
+    File object over a package download that appends what is read to the .part file of the cache, and moves it to
+    the cache with its metadata once the download is complete. A resumed download is read from the .part file first.
+    """
+    def __init__(self, response, url, path, part_path, resume):
+        self.response = response
+        self.url = url
+        self.path = path
+        self.part_path = part_path
+        self.sha256 = hashlib.sha256()
+        self.complete = False
+        self.validators = {'etag': response.headers.get('ETag'),
+                           'last_modified': response.headers.get('Last-Modified')}
+        if resume:  # Content-Range: bytes <start>-<end>/<total>
+            total = response.headers.get('Content-Range', '').rpartition('/')[2]
+        else:
+            total = response.headers.get('Content-Length')
+        self.expected_size = int(total) if total and total.isdigit() else None
+        if resume:
+            self.prefix = open(part_path, 'rb')
+            self.part = open(part_path, 'ab')
+        else:
+            self.prefix = None
+            self.part = open(part_path, 'wb')
+            _write_json(part_path + ".json", self.validators)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def read(self, size=-1):
+        if self.prefix is not None:
+            data = self.prefix.read(size)
+            if data:
+                self.sha256.update(data)
+                return data
+            self.prefix.close()
+            self.prefix = None
+        data = self.response.read(size)
+        if data:
+            self.part.write(data)
+            self.sha256.update(data)
+        elif not self.complete:
+            self._store()
+        return data
+
+    def drain(self):
+        """Reads what is left of the download, so the archive is cached even if the reader stopped before its end."""
+        while self.read(CHUNK_SIZE):
+            pass
+
+    def close(self):
+        try:
+            if not self.complete:
+                self.drain()
+        except Exception as e:
+            print(f"Download of {self.url} interrupted, it will be resumed: {e}")
+        finally:
+            if self.prefix is not None:
+                self.prefix.close()
+            self.part.close()
+            self.response.close()
+
+    def _store(self):
+        self.part.close()
+        size = os.path.getsize(self.part_path)
+        if self.expected_size is not None and size != self.expected_size:
+            raise OSError(f"incomplete download ({size} of {self.expected_size} bytes)")
+        self.complete = True
+        os.replace(self.part_path, self.path)
+        _write_json(self.path + ".json", {
+            'url': self.url,
+            'size': size,
+            'sha256': self.sha256.hexdigest(),
+            'date': dt.now().strftime('%Y-%m-%d %H:%M:%S'),
+            **self.validators
+        })
+        if os.path.exists(self.part_path + ".json"):
+            os.remove(self.part_path + ".json")
@@ -0,0 +1,488 @@
+#This module groups the functions to read the TED yearly CSV exports (one row per lot) as one row per Contract Award Notice.
+import os
+import re
+import json
+import shutil
+import pandas as pd
+from tqdm import tqdm
+
+# CAN level columns of the yearly CSVs, with their types and the columns that need a conversion
+COLUMNS_CAN_LEVEL = ['ID_NOTICE_CAN', 'TED_NOTICE_URL', 'YEAR', 'ID_TYPE', 'DT_DISPATCH', 'XSD_VERSION', 'CANCELLED', 'CORRECTIONS', 'B_MULTIPLE_CAE', 'CAE_NAME', 'CAE_NATIONALID', 'CAE_ADDRESS', 'CAE_TOWN', 'CAE_POSTAL_CODE', 'CAE_GPA_ANNEX', 'ISO_COUNTRY_CODE', 'ISO_COUNTRY_CODE_GPA', 'B_MULTIPLE_COUNTRY', 'ISO_COUNTRY_CODE_ALL', 'CAE_TYPE', 'EU_INST_CODE', 'MAIN_ACTIVITY', 'B_ON_BEHALF', 'B_INVOLVES_JOINT_PROCUREMENT', 'B_AWARDED_BY_CENTRAL_BODY', 'TYPE_OF_CONTRACT', 'B_FRA_AGREEMENT', 'FRA_ESTIMATED', 'B_DYN_PURCH_SYST', 'CPV', 'MAIN_CPV_CODE_GPA', 'B_GPA', 'GPA_COVERAGE', 'LOTS_NUMBER', 'VALUE_EURO', 'VALUE_EURO_FIN_1', 'VALUE_EURO_FIN_2', 'TOP_TYPE', 'B_ACCELERATED', 'OUT_OF_DIRECTIVES', 'B_ELECTRONIC_AUCTION', 'NUMBER_AWARDS']
+DTYPES = {
+    'ID_NOTICE_CAN': 'str',
+    'TED_NOTICE_URL': 'str',
+    'XSD_VERSION': 'str',
+    'CANCELLED': 'bool',
+    'CAE_NAME': 'str',
+    'CAE_NATIONALID': 'str',
+    'CAE_ADDRESS': 'str',
+    'CAE_TOWN': 'str',
+    'CAE_POSTAL_CODE': 'str',
+    'CAE_GPA_ANNEX': 'str',
+    'ISO_COUNTRY_CODE': 'str',
+    'ISO_COUNTRY_CODE_GPA': 'str',
+    'ISO_COUNTRY_CODE_ALL': 'str',
+    'CAE_TYPE': 'str',
+    'EU_INST_CODE': 'str',
+    'MAIN_ACTIVITY': 'str',
+    'TYPE_OF_CONTRACT': 'str',
+    'FRA_ESTIMATED': 'str',
+    'VALUE_EURO': 'float',
+    'VALUE_EURO_FIN_1': 'float',
+    'VALUE_EURO_FIN_2': 'float',
+    'TOP_TYPE': 'str'
+}
+BOOL_COLS = ['B_MULTIPLE_CAE', 'B_MULTIPLE_COUNTRY', "B_ON_BEHALF", "B_INVOLVES_JOINT_PROCUREMENT",
+             "B_AWARDED_BY_CENTRAL_BODY", "B_FRA_AGREEMENT", "B_DYN_PURCH_SYST", "B_GPA", "B_ACCELERATED",
+             "B_ELECTRONIC_AUCTION", "OUT_OF_DIRECTIVES"]
+INT_COLS = ['GPA_COVERAGE', 'CPV', 'CORRECTIONS', 'ID_TYPE', 'YEAR', 'MAIN_CPV_CODE_GPA']
+# Values read as NaN by pd.read_csv, and values accepted by bool dtype columns
+NA_VALUES = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>', 'N/A',
+             'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null']
+BOOL_VALUES = {'True': True, 'TRUE': True, 'true': True, '1': True, 'False': False, 'FALSE': False, 'false': False, '0': False}
+CONVERTED_COLS = BOOL_COLS + INT_COLS + ['LOTS_NUMBER', 'DT_DISPATCH']  # Read as raw strings, then converted
+BOOL_CONVERTER_VALUES = {'': False, 'Y': True, '1': True, 'N': False, '0': False}
+DATE_FORMAT = '%d/%m/%y'
+CSV_BLOCK_SIZE = 16 * 2**20  # Bytes of CSV read at a time by iter_csv_notices
+SNAPSHOT_FOLDER = "./cache/ted-csv/"  # Parquet snapshot of the formatted notices, one year=YYYY partition per year
+SNAPSHOT_YEARS_FILE = "_export_years.json"  # Years of the exports loaded in full into the snapshot
+# Columns of ted-csv used to enrich the notices in the processing pipelines
+ENRICHMENT_COLUMNS = ['VALUE_EURO_FIN_2', 'B_MULTIPLE_COUNTRY', 'B_AWARDED_BY_CENTRAL_BODY', 'B_INVOLVES_JOINT_PROCUREMENT',
+                      'B_DYN_PURCH_SYST', 'B_ELECTRONIC_AUCTION', 'B_ON_BEHALF', 'B_FRA_AGREEMENT', 'FRA_ESTIMATED', 'CAE_TYPE']
+
+
+def transform_id(id_csv): #Function to swap the ID_NOTICE_CAN field so it aligns with the one used in the xml format
+    year_part = str(id_csv)[:4]
+    id_xml = str(id_csv)[4:].zfill(8) + '-' + year_part
+    return id_xml
+
+
+#Vectorised converters: they take a column of raw strings and raise ValueError naming the column on unexpected values
+def _unexpected_value(col, values, invalid):
+    raise ValueError(f"Unexpected value '{values[invalid].iloc[0]}' found in the column {col}.")
+
+def convert_bool(col, values): #'' -> False, Y/1 -> True, N/0 -> False
+    converted = values.map(BOOL_CONVERTER_VALUES)
+    invalid = converted.isna()
+    if invalid.any():
+        _unexpected_value(col, values, invalid)
+    return converted.astype(bool)
+
+def convert_int(col, values): #'' -> -1, integers as int()
+    stripped = values.str.strip()
+    empty = values == ''
+    invalid = ~(empty | stripped.str.fullmatch(r'[+-]?\d+'))
+    if invalid.any():
+        raise ValueError(f"invalid literal for int() with base 10: '{values[invalid].iloc[0]}' in the column {col}")
+    return stripped.where(~empty, '-1').astype('int64')
+
+def convert_lots(col, values): #'' -> 0, digits -> int
+    empty = values == ''
+    invalid = ~(empty | values.str.isdigit())
+    if invalid.any():
+        _unexpected_value(col, values, invalid)
+    return values.where(~empty, '0').astype('int64')
+
+def convert_date(col, values): #dd/mm/yy dates, as dt.strptime
+    converted = pd.to_datetime(values, format=DATE_FORMAT, errors='coerce')
+    invalid = converted.isna()
+    if invalid.any():
+        raise ValueError(f"time data '{values[invalid].iloc[0]}' does not match format '{DATE_FORMAT}' in the column {col}")
+    return converted
+
+CONVERTERS = {col: convert_bool for col in BOOL_COLS}
+CONVERTERS.update({col: convert_int for col in INT_COLS})
+CONVERTERS['LOTS_NUMBER'] = convert_lots
+CONVERTERS['DT_DISPATCH'] = convert_date
+
+
+def convert_columns(df): #Converts the CONVERTED_COLS of a DataFrame read as raw strings
+    for col in CONVERTED_COLS:
+        df[col] = CONVERTERS[col](col, df[col].fillna('').astype(str))
+    return df
+
+
+def format_notices(df_flat): #Final formatting of the notices (one row per CAN, indexed by ID_NOTICE_CAN)
+    df_flat.index = df_flat.index.to_series().apply(transform_id)
+    df_flat.fillna({'VALUE_EURO': -1.,
+                   'VALUE_EURO_FIN_1': -1.,
+                   'VALUE_EURO_FIN_2': -1., }, inplace=True) #JSON Parser does not accept na. We set them at -1.
+    #df_flat = df_flat.where(pd.notnull(df_flat), None)  # OpenSearch does not accept pd.nan We convert them to None
+    df_flat = df_flat.replace({'ISO_COUNTRY_CODE': {'UK': 'GB'}})
+    return df_flat
+
+
+def csv_file_year(file_name):
+    match = re.search(r'(\d{4})', os.path.basename(file_name))
+    return int(match.group(1)) if match else None
+
+
+def list_csv_files(folder_path, years=None): #CSV exports of the folder, only those of the given years if any
+    csv_files = [os.path.join(folder_path, csv_file) for csv_file in os.listdir(folder_path) if csv_file.startswith("export_CAN")]
+    if years is not None:
+        years = {int(year) for year in years}
+        csv_files = [file_path for file_path in csv_files if csv_file_year(file_path) in years]
+    return csv_files
+
+
+def read_csv_file(file_path): #Typed read of a yearly csv: converted columns are read as raw strings, then vectorised
+    dtypes = {**DTYPES, **{col: 'str' for col in CONVERTED_COLS}}
+    na_values = {col: NA_VALUES for col in COLUMNS_CAN_LEVEL if col not in CONVERTED_COLS}
+    df = pd.read_csv(file_path, usecols=COLUMNS_CAN_LEVEL, dtype=dtypes, keep_default_na=False, na_values=na_values)
+    return convert_columns(df)
+
+
+def read_csvs(folder_path, years=None): #Reads all yearly csv (or those of years) and concats them. Groups by CAN ID.
+    dfs = []
+
+    csv_files = list_csv_files(folder_path, years)
+    with tqdm(total=len(csv_files), desc="Loading CSVs", colour='white', unit='year',
+              bar_format="{desc}: |{bar}| {n}/{total}") as pbar:
+        for file_path in csv_files:
+            dfs.append(read_csv_file(file_path))
+            pbar.update(1)
+
+    df = pd.concat(dfs, ignore_index=True)
+
+    df_flat = df.groupby('ID_NOTICE_CAN').first()
+    return format_notices(df_flat)
+
+
+def convert_chunk(df): #Types a chunk of raw CSV strings as read_csv_file does
+    for col in COLUMNS_CAN_LEVEL:
+        if col in CONVERTERS:
+            continue
+        values = df[col].mask(df[col].isin(NA_VALUES))
+        dtype = DTYPES.get(col, 'str')
+        if dtype == 'float':
+            df[col] = values.astype(float)
+        elif dtype == 'bool':
+            if values.isna().any():
+                raise ValueError(f"Bool column has NA values in column {col}")
+            invalid = ~values.isin(BOOL_VALUES)
+            if invalid.any():
+                _unexpected_value(col, values, invalid)
+            df[col] = values.map(BOOL_VALUES).astype(bool)
+        else:
+            df[col] = values
+    return convert_columns(df)
+
+
+def _reduce_notices(df): #First non-null value of every column per notice, in order of appearance (as read_csvs)
+    return df.groupby(level=0, sort=False).first()
+
+
+def iter_csv_notices(folder_path, batch_size=100000, block_size=CSV_BLOCK_SIZE, years=None, window=None): #Streaming version of read_csvs, yields batches of formatted notices
+    """
+    Yields the notices of the CSVs of folder_path in batches of batch_size, with the same documents as read_csvs.
+    Reduced notices stay pending until window (batch_size by default) newer notices have been read, so rows of a
+    notice that appear again later in the file are combined into it. Rows further apart than that, of a notice
+    already yielded, can not be combined any more and are reported.
+    """
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    window = batch_size if window is None else window
+    read_options = pa_csv.ReadOptions(block_size=block_size)
+    convert_options = pa_csv.ConvertOptions(include_columns=COLUMNS_CAN_LEVEL,
+                                            column_types={col: pa.string() for col in COLUMNS_CAN_LEVEL},
+                                            strings_can_be_null=False)  # Raw strings, NA values are handled by convert_chunk
+    pending = None  # Reduced notices not yet yielded, indexed by ID in order of appearance
+    for file_path in tqdm(list_csv_files(folder_path, years), desc="Reading CSVs", unit='year'):
+        yielded = set()  # Notices of the file already yielded
+        carry = None  # Rows of the last notice of the previous chunk, which may continue in the next one
+        lost_rows = 0
+        reader = pa_csv.open_csv(file_path, read_options=read_options, convert_options=convert_options)
+        while True:
+            try:
+                batch = reader.read_next_batch()
+            except StopIteration:
+                batch = None
+            if batch is None:
+                chunk, next_carry = carry, None
+            else:
+                chunk = convert_chunk(batch.to_pandas())[COLUMNS_CAN_LEVEL]
+                if carry is not None:
+                    chunk = pd.concat([carry, chunk], ignore_index=True)
+                last_id = chunk['ID_NOTICE_CAN'].iloc[-1] if len(chunk) else None
+                is_last = chunk['ID_NOTICE_CAN'] == last_id
+                chunk, next_carry = chunk[~is_last], chunk[is_last]
+            if chunk is not None and len(chunk):
+                is_lost = chunk['ID_NOTICE_CAN'].isin(yielded)
+                if is_lost.any():
+                    lost_rows += int(is_lost.sum())
+                    chunk = chunk[~is_lost]
+                df_flat = _reduce_notices(chunk.set_index('ID_NOTICE_CAN'))
+                if pending is None:
+                    pending = df_flat
+                else:
+                    is_late = df_flat.index.isin(pending.index)
+                    if is_late.any():  # Notices seen earlier in the file: their late rows fill the missing values
+                        pending = _reduce_notices(pd.concat([pending, df_flat[is_late]]))
+                        df_flat = df_flat[~is_late]
+                    pending = pd.concat([pending, df_flat])
+                while len(pending) >= batch_size + window:
+                    batch_notices, pending = pending.iloc[:batch_size], pending.iloc[batch_size:]
+                    yielded.update(batch_notices.index)
+                    yield format_notices(batch_notices.copy())
+            carry = next_carry
+            if batch is None:
+                break
+        if lost_rows:
+            print(f"{os.path.basename(file_path)}: {lost_rows} rows of notices already yielded (more than {window} "
+                  f"notices earlier in the file) were ignored")
+    while pending is not None and len(pending):
+        batch_notices, pending = pending.iloc[:batch_size], pending.iloc[batch_size:]
+        yield format_notices(batch_notices.copy())
+
+
+def notice_hashes(df_flat):
+    """64-bit content hash of every formatted notice (ID and column values), computed column-wise."""
+    return pd.util.hash_pandas_object(df_flat, index=True)
+
+
+class NoticeHashes:
+    """
+    Content hashes of the notices loaded into the index, kept as one <year>.parquet file per year (year of the
+    notice ID) in folder. changed() tells which notices of a batch are new or differ from the last load, record()
+    keeps the hashes of the ones indexed, and save() writes the years recorded, once the load is over.
+    The hashes are those of one index: with client and index, they are dropped when that index was deleted or
+    recreated since they were saved (its uuid changed), so every notice is loaded again. reset drops them as well.
+    """
+    def __init__(self, folder, client=None, index=None, reset=False):
+        self.folder = folder
+        self.client = client
+        self.index = index
+        self.hashes = {}  # year -> Series of hashes indexed by notice ID, loaded on first use
+        self.updates = {}  # year -> Series of hashes recorded since the last save, merged by save()
+        stored_uuid = self._stored_uuid()
+        if reset or (client is not None and stored_uuid != self._index_uuid()):
+            if os.path.exists(folder):
+                print(f"Content hashes in {folder} do not match the index {index}, all notices are loaded again")
+                shutil.rmtree(folder)
+
+    def year_path(self, year):
+        return os.path.join(self.folder, f"{year}.parquet")
+
+    def uuid_path(self):
+        return os.path.join(self.folder, "index_uuid")
+
+    def _stored_uuid(self):
+        if not os.path.exists(self.uuid_path()):
+            return None
+        with open(self.uuid_path(), 'r', encoding='utf-8') as file:
+            return file.read().strip()
+
+    def _index_uuid(self): #uuid of the index, None when it does not exist
+        if self.client is None or not self.client.indices.exists(index=self.index):
+            return None
+        response = self.client.indices.get_settings(index=self.index, name="index.uuid", flat_settings=True)
+        return next(iter(response.values()))["settings"]["index.uuid"]
+
+    def _year(self, year):
+        if year not in self.hashes:
+            path = self.year_path(year)
+            if os.path.exists(path):
+                df = pd.read_parquet(path)
+                self.hashes[year] = pd.Series(df['hash'].to_numpy(), index=pd.Index(df['id'].tolist(), dtype=object))
+            else:
+                self.hashes[year] = pd.Series([], index=pd.Index([], dtype=object), dtype='uint64')
+        return self.hashes[year]
+
+    @staticmethod
+    def _by_year(hashes):
+        return hashes.groupby(hashes.index.str[-4:], sort=False)  # IDs are formatted as NNNNNNNN-YYYY
+
+    def changed(self, df_flat):
+        """Hashes of the notices of df_flat (indexed by ID) that are new or changed, as a Series indexed by ID."""
+        hashes = notice_hashes(df_flat)
+        changed = []
+        for year, year_hashes in self._by_year(hashes):
+            stored = self._year(year).reindex(year_hashes.index, fill_value=0)  # 0 for the new notices
+            changed.append(year_hashes[stored.to_numpy() != year_hashes.to_numpy()])
+        return pd.concat(changed) if changed else hashes
+
+    def record(self, hashes):
+        """Keeps the hashes (as returned by changed) of the notices that were indexed, their years are saved later."""
+        for year, year_hashes in self._by_year(hashes):
+            self.updates.setdefault(year, []).append(year_hashes)
+
+    def save(self):
+        """Writes each year recorded since the last save once, with the uuid of the index the notices were loaded to."""
+        os.makedirs(self.folder, exist_ok=True)
+        for year, updates in self.updates.items():
+            stored = self._year(year)
+            updated = pd.concat(updates)
+            stored = pd.concat([stored[~stored.index.isin(updated.index)], updated])
+            self.hashes[year] = stored
+            path = self.year_path(year)
+            pd.DataFrame({'id': stored.index.astype(str), 'hash': stored.to_numpy()}).to_parquet(path + ".tmp")
+            os.replace(path + ".tmp", path)  # A crash while saving keeps the previous hashes
+        self.updates = {}
+        index_uuid = self._index_uuid()
+        if index_uuid is not None:
+            with open(self.uuid_path() + ".tmp", 'w', encoding='utf-8') as file:
+                file.write(index_uuid)
+            os.replace(self.uuid_path() + ".tmp", self.uuid_path())
+
+
+class CsvSnapshot:
+    """
+    Year-partitioned parquet copy of the formatted notices (<folder>/year=YYYY/*.parquet, year of the notice ID),
+    keyed by the transformed notice ID in the ID_NOTICE_CAN column. Batches are written to a staging folder, and
+    commit() merges them into the partitions: the notices staged replace their former rows, the other notices of the
+    partition are kept (an export can hold notices of other years, which must not replace their own partition).
+    As such a partition may hold only a few notices of its year, commit() also records the yearly exports that were
+    loaded in full (SNAPSHOT_YEARS_FILE), the only years CsvLookup takes as complete.
+    """
+    def __init__(self, folder=SNAPSHOT_FOLDER):
+        self.folder = folder
+        self.staging = os.path.join(folder, "_staging")
+        self.years = set()
+        self.parts = 0
+
+    def write(self, df_flat):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        if not self.parts and os.path.exists(self.staging):  # Left by an interrupted run
+            shutil.rmtree(self.staging)
+        df = df_flat.rename_axis('ID_NOTICE_CAN').reset_index()
+        for year, df_year in df.groupby(df['ID_NOTICE_CAN'].str[-4:], sort=False):
+            table = pa.Table.from_pandas(df_year, preserve_index=False)
+            for i, field in enumerate(table.schema):  # Columns without any value are typed as the string columns they are
+                if pa.types.is_null(field.type):
+                    table = table.set_column(i, field.name, table.column(i).cast(pa.string()))
+            folder = os.path.join(self.staging, f"year={year}")
+            os.makedirs(folder, exist_ok=True)
+            pq.write_table(table, os.path.join(folder, f"part-{self.parts:05}.parquet"))
+            self.parts += 1
+            self.years.add(year)
+
+    def commit(self, export_years=()):
+        """Merges the staged notices into the partitions, then records export_years as loaded in full."""
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+        for year in sorted(self.years):
+            partition = os.path.join(self.folder, f"year={year}")
+            table = pq.read_table(os.path.join(self.staging, f"year={year}"))
+            if os.path.exists(partition):  # Notices of the partition that were not staged again are kept
+                stored = pq.read_table(partition)
+                kept = stored.filter(pc.invert(pc.is_in(stored['ID_NOTICE_CAN'], value_set=table['ID_NOTICE_CAN'])))
+                table = pa.concat_tables([kept, table], promote_options="permissive")
+            os.makedirs(partition + ".new", exist_ok=True)
+            pq.write_table(table, os.path.join(partition + ".new", "part-00000.parquet"))
+            if os.path.exists(partition):
+                os.replace(partition, partition + ".old")
+            os.replace(partition + ".new", partition)
+            if os.path.exists(partition + ".old"):
+                shutil.rmtree(partition + ".old")
+        shutil.rmtree(self.staging, ignore_errors=True)
+        self.years = set()
+        self.parts = 0
+        if export_years:
+            years = sorted(snapshot_export_years(self.folder) | {str(year) for year in export_years})
+            path = os.path.join(self.folder, SNAPSHOT_YEARS_FILE)
+            os.makedirs(self.folder, exist_ok=True)
+            with open(path + ".tmp", 'w', encoding='utf-8') as file:
+                json.dump(years, file)
+            os.replace(path + ".tmp", path)
+
+
+def snapshot_export_years(folder=SNAPSHOT_FOLDER): #Years of the exports loaded in full into the snapshot, as strings
+    path = os.path.join(folder, SNAPSHOT_YEARS_FILE)
+    if not os.path.exists(path):
+        return set()
+    with open(path, 'r', encoding='utf-8') as file:
+        return set(json.load(file))
+
+
+def id_keys(doc_ids):
+    """
+    int64 keys of notice IDs formatted as NNNNNNNN-YYYY (year * 10**12 + number), sorted as the IDs of a year.
+    IDs of another format get the key -1, which matches no notice.
+    """
+    import numpy as np
+    keys = np.full(len(doc_ids), -1, dtype=np.int64)
+    for position, doc_id in enumerate(doc_ids):
+        number, _, year = doc_id.rpartition('-')
+        if number.isdigit() and year.isdigit() and len(number) <= 12:
+            keys[position] = int(year) * 10**12 + int(number)
+    return keys
+
+
+class CsvLookup:
+    """
+    In-memory lookup over the parquet snapshot: get(doc_id) returns the columns of a notice with the same values as
+    the _source of its ted-csv document, and raises KeyError when it is not in the CSV exports.
+    The columns stay Arrow arrays and the IDs a sorted numpy array of id_keys, searched with searchsorted, so there
+    is no python object per notice (forked worker processes share them). Only the years of the exports loaded in
+    full (snapshot_export_years) are complete: the notices of other years missing from the snapshot are fetched
+    from the index with client (when given), with one mget per get_many call.
+    """
+    def __init__(self, folder=SNAPSHOT_FOLDER, columns=ENRICHMENT_COLUMNS, client=None, index='ted-csv'):
+        import numpy as np
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.columns = list(columns)
+        self.client = client
+        self.index = index
+        self.years = snapshot_export_years(folder)  # Years whose notices missing from the snapshot are not in ted-csv
+        tables = []
+        partitions = sorted(os.listdir(folder)) if os.path.isdir(folder) else []
+        for partition in partitions:
+            if not partition.startswith("year=") or not partition[len("year="):].isdigit():  # Not .old/.new
+                continue
+            tables.append(pq.read_table(os.path.join(folder, partition), columns=['ID_NOTICE_CAN'] + self.columns,
+                                        memory_map=True))
+        if tables:
+            table = pa.concat_tables(tables, promote_options="permissive")
+        else:
+            table = pa.table({column: pa.array([], pa.string()) for column in ['ID_NOTICE_CAN'] + self.columns})
+        keys = id_keys(table['ID_NOTICE_CAN'].to_pylist())
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.table = table.select(self.columns).take(pa.array(order)).combine_chunks()
+        del keys, order
+
+    def __len__(self):
+        return len(self.keys)
+
+    def bind(self, client):
+        """Copy of the lookup sharing its arrays, which fetches the years missing from the snapshot with client."""
+        import copy
+        lookup = copy.copy(self)
+        lookup.client = client
+        return lookup
+
+    def get(self, doc_id):
+        sources = self.get_many([doc_id])
+        if doc_id not in sources:
+            raise KeyError(f"{doc_id} not found in {self.index}")
+        return sources[doc_id]
+
+    def get_many(self, doc_ids):
+        """
+        Sources of the notices of doc_ids found, as a dict by ID. Notices missing from the snapshot, of years not
+        loaded in full, are fetched with a single mget, limited to the lookup columns.
+        """
+        import numpy as np
+        import pyarrow as pa
+        doc_ids = list(doc_ids)
+        keys = id_keys(doc_ids)
+        positions = np.minimum(np.searchsorted(self.keys, keys), max(len(self.keys) - 1, 0))
+        found = (keys >= 0) & (self.keys[positions] == keys) if len(self.keys) else np.zeros(len(keys), dtype=bool)
+        rows = self.table.take(pa.array(positions[found])) if found.any() else None
+        sources = {}
+        if rows is not None:
+            columns = [[None if value is None else value.isoformat() for value in rows.column(column).to_pylist()]
+                       if pa.types.is_timestamp(rows.schema.field(column).type) else rows.column(column).to_pylist()
+                       for column in self.columns]  # Dates as their ISO string, as column_values
+            for doc_id, values in zip((doc_id for doc_id, is_found in zip(doc_ids, found) if is_found), zip(*columns)):
+                sources[doc_id] = dict(zip(self.columns, values))
+        missing = [doc_id for doc_id, is_found in zip(doc_ids, found) if not is_found and doc_id[-4:] not in self.years]
+        if missing and self.client is not None:
+            response = self.client.mget(index=self.index, body={"ids": missing}, _source_includes=self.columns)
+            for doc in response["docs"]:
+                if doc.get("found"):
+                    sources[doc["_id"]] = doc["_source"]
+        return sources
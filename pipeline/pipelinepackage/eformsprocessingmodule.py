@@ -0,0 +1,354 @@
+#This module groups the extraction of the procure_v5 fields of the TED eForms notices (ted-eforms), so that the
+#worker processes of processing-pipeline-eforms can import it.
+from datetime import datetime
+import traceback
+import json
+from pipelinepackage import processingmodule as proc
+from pipelinepackage.scanmodule import ProcessedNotice
+
+SOURCE_INDEX = "ted-eforms"
+CPV_DICT = proc.import_CPVDict()  # CPV descriptions, loaded once per process
+
+
+def id_key(value):
+    """Hashable form of a cbc:ID, which is a dict when the element has attributes (e.g. schemeName)."""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, sort_keys=True)
+    return value
+
+
+def index_by_id(items):
+    """Dict of items (a list, or a single dict) by the id_key of their cbc:ID, keeping the first item of each ID."""
+    if isinstance(items, dict):
+        items = [items]
+    return {id_key(item["cbc:ID"]): item for item in reversed(items)}
+
+
+def index_organizations(all_organizations):
+    """
+    Dict of the companies of all_organizations by the id_key of their ID, built once per notice for get_organization_data (the
+    last company of each ID is kept). None when an organization has no ID, every organization is then unknown.
+    """
+    if isinstance(all_organizations, dict):
+        all_organizations = [all_organizations]
+    try:
+        return {id_key(org["efac:Company"]["cac:PartyIdentification"]["cbc:ID"]): org["efac:Company"]
+                for org in all_organizations}
+    except KeyError:
+        return None
+
+
+def get_organization_data(id, organizations):
+    if organizations is None:
+        return {}
+    try:
+        organization = organizations.get(id_key(id), {})
+        name = organization.get("cac:PartyName", {}) #Apparently there can be multiple names
+        natid = organization.get("cac:PartyLegalEntity", {}) #And IDs
+        if isinstance(name, list):
+            name = name[0]
+        if isinstance(natid, list):
+            natid = natid[0]
+        return {
+            "Name": name.get("cbc:Name", "-"),
+            "National ID": natid.get("cbc:CompanyID", -1),
+            "Address": {
+                "Country": organization.get("cac:PostalAddress", {}).get("cac:Country", {}).get(
+                    "cbc:IdentificationCode", "-"),
+                "Town": organization.get("cac:PostalAddress", {}).get("cbc:CityName", "-"),
+                "Postal Code": organization.get("cac:PostalAddress", {}).get("cbc:PostalZone", "-"),
+                "Address": organization.get("cac:PostalAddress", {}).get("cbc:StreetName", "-"),
+                "Territorial Unit (NUTS3)": organization.get("cac:PostalAddress", {}).get(
+                    "cbc:CountrySubentityCode", "-")
+            },
+            "Contact": {
+                "URL": organization.get("cbc:WebsiteURI", "-"),
+                "Email": organization.get("cac:Contact", {}).get("cbc:Telephone", "-"),
+                "Phone": organization.get("cac:Contact", {}).get("cbc:ElectronicMail", "-")
+            }
+        }
+    except KeyError:
+        return {}
+
+
+def extract_contracting_authority(cparty, organizations):
+    cparty_id = cparty.get("cac:PartyIdentification", {}).get("cbc:ID", "-")
+    cparty_data = get_organization_data(cparty_id, organizations)
+    cparty_data["Activity"] = cparty.get("cac:ContractingActivity",{}).get("cbc:ActivityTypeCode","-")
+    cparty_types = cparty.get("cac:ContractingActivity",[])
+    if isinstance(cparty_types, dict):
+        cparty_types = [cparty_types]
+    cparty_data["CA Type"] = [type.get("cbc:PartyTypeCode","-") for type in cparty_types]
+    return cparty_data
+
+
+def extract_lots(lots):
+    extracted_lots = []
+    if isinstance(lots, dict):
+        lots = [lots]
+    number_of_lots = len(lots)
+    for lot in lots:
+        # Extract the criteria and their weights
+        lot_project = lot.get("cac:ProcurementProject", {})
+        ac_list = lot.get("cac:TenderingTerms", {}).get("cac:AwardingTerms", {}).get("cac:AwardingCriterion", [])
+        if isinstance(ac_list, dict):
+            ac_list = [ac_list]
+        sac = []
+        for ac in ac_list:
+            subcriteria = ac.get("cac:SubordinateAwardingCriterion", [])
+            if isinstance(subcriteria, dict):
+                subcriteria = [subcriteria]
+            sac = sac + subcriteria
+        criteria_list = []
+        for ac in sac:
+            if ac:
+                try:
+                    #PRICE CRITERIA
+                    criteria_type = ac.get("cbc:AwardingCriterionTypeCode", "-").capitalize()
+                    acparam = (ac.get("ext:UBLExtensions", {}).get("ext:UBLExtension",{}).get("ext:ExtensionContent",{}).get("efext:EformsExtension",{}).get("efac:AwardCriterionParameter",[]))
+                    if acparam:
+                        if isinstance(acparam, list):
+                            acparam = acparam[0]
+                        criteria_weight = acparam.get("efbc:ParameterNumeric",-1)
+                    else:
+                        criteria_weight = -1
+                    try:
+                        criteria_weight = float(criteria_weight)/100
+                    except ValueError:
+                        criteria_weight = -1.0
+                    criteria = {"Type": criteria_type,
+                                "Weight": criteria_weight}
+
+                    criteria_list.append(criteria)
+                except Exception as e:
+                    print(f"Error extracting criteria: {e}")
+                    print(ac)
+            else:
+                print("warning: no criteria")
+                criteria_list = []
+        extracted_lots.append({
+            "Lot Number": lot.get("cbc:ID", "-"),
+            "Title": lot_project.get("cbc:Name", "-"),
+            "Short Description": lot_project.get("cbc:Description", "-"),
+            "Title (Translated)": "-", #Empty for now, translator later
+            "Short Description (Translated)": "-",
+            "Criteria": criteria_list,
+            "Main Criterion": proc.get_main_criterion(criteria_list),
+            "CPV Codes": lot_project.get("cac:MainCommodityClassification", {}).get("cbc:ItemClassificationCode", -1)
+        })
+
+    return number_of_lots, extracted_lots
+
+
+
+
+
+def extract_awarded_contracts(extensions, organizations=None):
+    result = extensions.get("efac:NoticeResult",{})
+    all_lot_results = result.get("efac:LotResult",[])
+    if isinstance(all_lot_results, dict):
+        all_lot_results = [all_lot_results]
+
+    # References are resolved through indexes by ID, built once per notice
+    settled_contracts = index_by_id(result.get("efac:SettledContract",[]))
+    all_lot_tenders = index_by_id(result.get("efac:LotTender", []))
+    all_tendering_parties = index_by_id(result.get("efac:TenderingParty", []))
+    if organizations is None:
+        organizations = index_organizations(extensions.get("efac:Organizations", {}).get("efac:Organization",[]))
+
+    awards = []
+    date_conclusion = None
+    aw_title = "-"
+    for lot_result in all_lot_results:
+        contractors_info = []
+        contractid =  lot_result.get("efac:SettledContract",{})
+        if isinstance(contractid, list): # apparently a lot result can have multiple associated contracts, what do they mean I do not know. Documentation is completely lacking so I will ignore these results.
+            contractid = contractid[0]
+        sett_contract = settled_contracts.get(id_key(contractid.get("cbc:ID")))
+        if sett_contract:
+            lot_tenders = sett_contract.get("efac:LotTender", {})
+            aw_title = sett_contract.get("cbc:Title", "-")
+            date_conclusion = sett_contract.get("cbc:IssueDate", None)
+            try:
+                if date_conclusion is not None:
+                    date_conclusion = datetime.strptime(date_conclusion, "%Y-%m-%d%z")
+            except ValueError:
+                date_conclusion = None  # Handle parsing errors
+        else: #Alternative route, there may not be settled contracts in the extensions but the link is made through LotTender directly
+            lot_tenders = lot_result.get("efac:LotTender",{})
+
+        if lot_tenders: #This in reality should take the tenderresultcode instead!!
+            if isinstance(lot_tenders, dict):
+                lot_tenders = [lot_tenders]
+            for lot_tender in lot_tenders:
+                lot_tender = all_lot_tenders.get(id_key(lot_tender["cbc:ID"]), {})
+                tendering_party = all_tendering_parties.get(id_key(lot_tender["efac:TenderingParty"]["cbc:ID"]), {})
+
+                org_list = tendering_party.get("efac:Tenderer",[])
+                if isinstance(org_list, dict):
+                    org_list = [org_list]
+                for org in org_list:
+                    search_id = org.get("cbc:ID",-1)
+                    new_org = get_organization_data(search_id, organizations)
+                    contractors_info.append(new_org)
+        statistics = lot_result.get("efac:ReceivedSubmissionsStatistics", [])
+        if statistics:
+            if isinstance(statistics, dict):
+                number_of_tenders = statistics.get("efbc:StatisticsNumeric",-1) #Apparently there can be a dict instead of a list and then there is no code, just default tender number
+            else:
+                if all("efbc:StatisticsCode" in stat.keys() for stat in statistics):
+                    stat_tenders = [stat for stat in statistics if stat["efbc:StatisticsCode"] == "tenders"]
+                    if stat_tenders:
+                        stat_tenders = stat_tenders[-1]
+                        number_of_tenders = stat_tenders.get("efbc:StatisticsNumeric",-1)
+                    else:
+                        number_of_tenders = -1
+                else: #Yes, there may be a list with multiple and contradicting entries, AND unlabelled. I will get the latest entry.
+                    number_of_tenders = statistics[-1].get("efbc:StatisticsNumeric",-1)
+        else:
+            number_of_tenders = -1
+
+
+        aw_info = {
+            "Awarded Contract Title": aw_title,
+            "Corresponding Lot": lot_result.get("efac:TenderLot", {}).get("cbc:ID", "-"),
+            "Number of Tenders": number_of_tenders,
+            "Contractors": contractors_info,
+            "Conclusion Date": date_conclusion
+        }
+        awards.append(aw_info)
+    return awards
+
+
+def process_hit(hit, csv_sources):
+    """
+    procure_v5 document of a ted-eforms hit, as a scanmodule.ProcessedNotice, or None when the notice can not be
+    extracted. csv_sources maps the notice IDs of the page to their ted-csv fields.
+    """
+    doc_id = hit["_id"]
+    try:
+        project = hit["_source"]["cac:ProcurementProject"]
+        lots = hit["_source"].get("cac:ProcurementProjectLot",{})
+        extensions = hit["_source"].get("ext:UBLExtensions", {}).get("ext:UBLExtension").get("ext:ExtensionContent").get("efext:EformsExtension")
+        cparties = hit["_source"].get("cac:ContractingParty", {})
+
+
+        organizations = hit["_source"]["ext:UBLExtensions"]["ext:UBLExtension"]["ext:ExtensionContent"]["efext:EformsExtension"]["efac:Organizations"]["efac:Organization"]
+        organizations = index_organizations(organizations)  # Shared by the contracting parties and the awards
+
+        value_eforms = extensions.get("efac:NoticeResult",{}).get("cbc:TotalAmount",-1)
+        title = project.get("cbc:Name", "-")
+        description = project.get("cbc:Description", "-")
+        locations = project.get("cac:RealizedLocation", {})
+        if isinstance(locations, list):
+            country = []
+            for loc in locations:
+                country.append(loc.get("cac:Address", {}).get("cac:Country", {}).get("cbc:IdentificationCode", "-"))
+        else:
+            country = locations.get("cac:Address", {}).get("cac:Country", {}).get("cbc:IdentificationCode", "-")
+        cpv = project.get("cac:MainCommodityClassification", {}).get("cbc:ItemClassificationCode", -1)
+        cpv_desc = CPV_DICT.get(cpv, "-")
+        add_cpv = project.get("cac:AdditionalCommodityClassification", None)
+        if add_cpv:
+            if isinstance(add_cpv, dict):
+                add_cpv = [add_cpv]
+            for cpv_i in add_cpv:
+                new_cpv = cpv_i["cbc:ItemClassificationCode"]
+                cpv = [cpv].append(new_cpv)
+                cpv_desc = [cpv_desc].append(CPV_DICT.get(new_cpv, "-"))
+        c_nature = project.get("cbc:ProcurementTypeCode", "Unknown")
+        proc_type = hit["_source"].get("cac:TenderingProcess", {}).get("cbc:ProcedureCode", "Unknown")
+        date_dispatch = hit["_source"].get("cbc:IssueDate", None)
+        try:
+            if date_dispatch is not None:
+                date_dispatch = datetime.strptime(date_dispatch, "%Y-%m-%d%z")
+        except ValueError:
+            date_dispatch = None  # Handle parsing errors
+
+        health_cpv = proc.process_health_cpv(cpv)
+        critical_cpv = proc.process_health_cpv(cpv)
+
+        if isinstance(cparties, list):
+            ca_data = []
+            for ca in cparties:
+                authority = extract_contracting_authority(ca.get("cac:Party", {}), organizations)
+                ca_data.append(authority)
+                ca_type = authority.get("CA Type","")
+        else:
+            authority = extract_contracting_authority(cparties.get("cac:Party", {}), organizations)
+            ca_data = authority
+            ca_type = authority.get("CA Type", "")
+        if isinstance(ca_data, list) and ca_data:
+            ca_name = ca_data[0].get("Name", "-")
+            ca_country = ca_data[0].get("Address", {}).get("Country", "-")
+        elif isinstance(ca_data, dict):
+            ca_name = ca_data.get("Name", "-")
+            ca_country = ca_data.get("Address", {}).get("Country", "-")
+        else:
+            ca_name = "-"
+            ca_country = "-"
+
+        number_of_lots, lot_data = extract_lots(lots)
+        awards_data = extract_awarded_contracts(extensions, organizations)
+
+        try:  ######################################################### Query for CSV data ################################################
+            csv_source = csv_sources[doc_id]  # KeyError when the notice is not in ted-csv
+            csv_found = True
+
+            value = csv_source["VALUE_EURO_FIN_2"]
+            value = proc.process_value(value)
+
+            multiple_country = csv_source["B_MULTIPLE_COUNTRY"]
+            central_body = csv_source["B_AWARDED_BY_CENTRAL_BODY"]
+            joint_procurement = csv_source["B_INVOLVES_JOINT_PROCUREMENT"]
+            dynamic_purch = csv_source["B_DYN_PURCH_SYST"]
+            eauction = csv_source["B_ELECTRONIC_AUCTION"]
+            on_behalf = csv_source["B_ON_BEHALF"]
+            ca_type = csv_source["CAE_TYPE"]
+
+            fram_agreement = csv_source.get("B_FRA_AGREEMENT", False)
+            fram_estimated = csv_source.get("FRA_ESTIMATED")
+            if fram_estimated and isinstance(fram_estimated, str):
+                if 'K' in fram_estimated or 'C' in fram_estimated:
+                    fram_agreement = True # K for when the keyword framework was detected in the description, C for consistency, previous notices were indicated as framework agreements. A third option has not been considered, A for multiple awards per lot, which may correspond with fram. agreements, dynamic purch. systems or innovation partnerships
+
+            proc_route = proc.calculate_p_route(multiple_country, joint_procurement, central_body, ca_type)
+            proc_technique = proc.calculate_p_technique(dynamic_purch, eauction, on_behalf, central_body, fram_agreement, multiple_country)
+            health_ca_class = proc.calculate_ca_class(ca_name, ca_country, central_body,ca_type,health_cpv)
+
+
+        except Exception as e:  ########################################## If CSV not found handler ###########################################
+            #print(f"An error occurred: {e}")
+            csv_found = False
+            try:
+                value = float(value_eforms)
+                value = proc.process_value(value)
+            except ValueError:
+                value = -1
+            proc_route = "Unknown"
+            proc_technique = {"Unknown":True}
+            health_ca_class = "Unknown"
+
+        title_translated = "-"  # No translation for now (too slow)
+        description_translated = "-"
+
+        sources = {"TED-EForms": True}
+        if csv_found:
+            sources["TED-CSV"] = True
+        tags = {"Source": sources,
+                "Process Date": datetime.now()
+                }
+
+        return ProcessedNotice(doc_id=doc_id, title=title, title_translated=title_translated,
+                               description=description, description_translated=description_translated,
+                               date_dispatch=date_dispatch, cpv=cpv, cpv_desc=cpv_desc, health_cpv=health_cpv,
+                               critical_cpv=critical_cpv, country=country, value=value, c_nature=c_nature,
+                               proc_route=proc_route, proc_type=proc_type, proc_technique=proc_technique,
+                               health_ca_class=health_ca_class, ca_data=ca_data, number_of_lots=number_of_lots,
+                               lot_data=lot_data, awards_data=awards_data, tags=tags)
+
+    except Exception as e: ########################################## Error extracting some field from XML ####################################
+        print(f"An unexpected error occurred: {e}")
+        traceback.print_exc()
+        print(json.dumps(hit, indent=4))
+        return None
@@ -0,0 +1,141 @@
+#This module groups the ingestion logs: buffered writers and a query helper, shared by the ingestion pipelines.
+from datetime import datetime as dt
+import threading
+import csv
+import os
+import pandas as pd
+
+LOG_FORMATS = ('parquet', 'csv')
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+PARTITION_COLUMN = 'day'  # Parquet logs are partitioned by day (day=YYYY-MM-DD folders)
+CSV_CHUNK_ROWS = 500000  # Rows read at a time when querying a CSV log
+
+
+def log_path(path, log_format):
+    """Path of a log given without extension: a .csv file, or a folder for the partitioned parquet dataset."""
+    return path + ".csv" if log_format == 'csv' else path
+
+
+class IngestionLog:
+    """
+    Append-only ingestion log. Records are buffered column by column in plain lists and written in batches of
+    flush_every records (and on flush/close), instead of building a DataFrame per record.
+    log_format='csv' appends to <path>.csv with the same layout as the former pandas logs, log_format='parquet' adds
+    one file per flush to the <path>/day=YYYY-MM-DD/ partitions. Both have the same columns.
+    append() may be called from several threads.
+    """
+    def __init__(self, path, columns, log_format='parquet', flush_every=20000):
+        if log_format not in LOG_FORMATS:
+            raise ValueError(f"Unknown log format '{log_format}'")
+        self.path = log_path(path, log_format)
+        self.columns = list(columns)
+        self.log_format = log_format
+        self.flush_every = flush_every
+        self.buffer = {column: [] for column in self.columns}
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.flush()
+
+    def append(self, **record):
+        """Buffers a record. Missing columns are left empty, except date which defaults to now."""
+        if 'date' in self.columns and record.get('date') is None:
+            record['date'] = dt.now().strftime(DATE_FORMAT)
+        with self.lock:
+            for column in self.columns:
+                self.buffer[column].append(record.get(column))
+            self.size += 1
+            if self.size >= self.flush_every:
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    close = flush
+
+    def _flush(self):
+        if not self.size:
+            return
+        buffer = self.buffer
+        self.buffer = {column: [] for column in self.columns}
+        self.size = 0
+        try:
+            if self.log_format == 'csv':
+                self._write_csv(buffer)
+            else:
+                self._write_parquet(buffer)
+        except Exception as e:
+            print(f"Failed to write {len(buffer[self.columns[0]])} log records to {self.path}: {e}")
+
+    def _write_csv(self, buffer):
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        write_header = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        with open(self.path, 'a', newline='', encoding='utf-8') as file:
+            writer = csv.writer(file, lineterminator='\n')
+            if write_header:
+                writer.writerow(self.columns)
+            writer.writerows(zip(*(buffer[column] for column in self.columns)))
+
+    def _write_parquet(self, buffer):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        columns = {column: pa.array([None if v is None else str(v) for v in values], type=pa.string())
+                   for column, values in buffer.items()}
+        dates = buffer['date'] if 'date' in buffer else [dt.now().strftime(DATE_FORMAT)] * len(buffer[self.columns[0]])
+        columns[PARTITION_COLUMN] = pa.array([date[:10] for date in dates], type=pa.string())
+        pq.write_to_dataset(pa.table(columns), root_path=self.path, partition_cols=[PARTITION_COLUMN])
+
+
+def read_log(path, log_format='parquet', package=None, status=None, start=None, end=None, columns=None):
+    """
+    Reads the records of a log (path given without extension as for IngestionLog) as a DataFrame.
+    package and status filter on an exact value or a list of values, start and end on the date (inclusive,
+    'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM:SS' strings or datetimes). Parquet logs only read the matching day partitions.
+    """
+    filters = []
+    for column, value in (('package', package), ('status', status)):
+        if value is not None:
+            filters.append((column, 'in', list(value) if isinstance(value, (list, tuple, set)) else [value]))
+    if start is not None:
+        start = start.strftime(DATE_FORMAT) if isinstance(start, dt) else str(start)
+        filters.append(('date', '>=', start))
+    if end is not None:
+        end = end.strftime(DATE_FORMAT) if isinstance(end, dt) else str(end)
+        if len(end) == 10:
+            end += ' 23:59:59'
+        filters.append(('date', '<=', end))
+    path = log_path(path, log_format)
+
+    if log_format == 'parquet':
+        import pyarrow.parquet as pq
+        partition_filters = list(filters)
+        if start is not None:
+            partition_filters.append((PARTITION_COLUMN, '>=', start[:10]))
+        if end is not None:
+            partition_filters.append((PARTITION_COLUMN, '<=', end[:10]))
+        table = pq.read_table(path, filters=partition_filters or None, columns=columns)
+        df = table.to_pandas()
+        if PARTITION_COLUMN in df.columns and (columns is None or PARTITION_COLUMN not in columns):
+            df = df.drop(columns=PARTITION_COLUMN)
+        return df
+
+    chunks = []
+    for chunk in pd.read_csv(path, dtype=str, keep_default_na=False, na_values=[''], chunksize=CSV_CHUNK_ROWS):
+        for column, op, value in filters:
+            if op == 'in':
+                chunk = chunk[chunk[column].isin(value)]
+            elif op == '>=':
+                chunk = chunk[chunk[column] >= value]
+            else:
+                chunk = chunk[chunk[column] <= value]
+        chunks.append(chunk if columns is None else chunk[columns])
+    if not chunks:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(chunks, ignore_index=True)
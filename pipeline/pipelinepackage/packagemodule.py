@@ -0,0 +1,130 @@
+#This module groups the functions to discover, fetch and read TED daily packages (.tar.gz archives of XML notices)
+#and to resume partially ingested packages.
+import tarfile
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import os
+
+
+def is_local(base_url):
+    """A base URL that is not http(s) is a local mirror: a folder with the <year>/<ojs>.tar.gz layout of PackageCache."""
+    return not base_url.startswith(("http://", "https://"))
+
+
+def package_url(base_url, year, ojs):
+    if is_local(base_url):
+        return os.path.join(base_url, str(year), f"{str(ojs).zfill(5)}.tar.gz")
+    return f"{base_url}{year}{str(ojs).zfill(5)}"
+
+
+def probe_package(url, timeout=30):
+    """HEAD request to a package URL. Returns the HTTP status (200, 404...) or None when the request failed."""
+    if is_local(url):
+        return 200 if os.path.isfile(url) else 404
+    try:
+        request = urllib.request.Request(url, method="HEAD")
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except Exception as e:
+        print(f"Error while checking {url}: {e}")
+        return None
+
+
+def discover_packages(base_url, year, ingested, workers=16, window=32):
+    """
+    Work list of a year: the OJS numbers not in ingested (already completed) that are published, in order.
+    OJS numbers are published without gaps, so the packages are probed concurrently with HEAD requests, window
+    numbers at a time after the last ingested one, until the first number that is not available.
+    Returns (work list, status of the first unavailable OJS): 404 means the end of the published packages was
+    reached, anything else (e.g. None for a network error) that the year could not be fully discovered.
+    """
+    last_ingested = max(ingested, default=0)
+    statuses = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        def probe(numbers):
+            urls = [package_url(base_url, year, ojs) for ojs in numbers]
+            statuses.update(zip(numbers, executor.map(probe_package, urls)))
+            return all(statuses[ojs] == 200 for ojs in numbers)
+
+        probe([ojs for ojs in range(1, last_ingested) if ojs not in ingested])  # Packages missed by earlier runs
+        start = last_ingested + 1
+        while probe(list(range(start, start + window))):
+            start += window
+    first_missing = min(ojs for ojs, status in statuses.items() if status != 200)
+    work = [ojs for ojs in sorted(statuses) if ojs < first_missing]
+    return work, statuses[first_missing]
+
+
+def open_package(url, timeout=60):
+    """
+    Opens the HTTP stream of a package, or the file of a local mirror. Raises urllib.error.HTTPError (e.g. 404 when
+    it is not published, also for missing mirror files).
+    """
+    if is_local(url):
+        if not os.path.isfile(url):
+            raise urllib.error.HTTPError(url, 404, "Not Found", None, None)
+        return open(url, 'rb')
+    return urllib.request.urlopen(url, timeout=timeout)
+
+
+def iter_package_notices(fileobj):
+    """
+    Yields (member name, XML bytes) for every notice of a package read sequentially from a .tar.gz stream (an HTTP
+    response or an open file). Members are decompressed and read one by one, nothing is written to disk.
+    """
+    with tarfile.open(fileobj=fileobj, mode='r|gz') as tar:
+        for member in tar:
+            if member.isfile() and member.name.endswith(".xml"):
+                yield member.name, tar.extractfile(member).read()
+
+
+def notice_hash(source):
+    """SHA-1 of the content of a notice, given as XML bytes or as a path."""
+    if not isinstance(source, (bytes, bytearray)):
+        with open(source, 'rb') as file:
+            source = file.read()
+    return hashlib.sha1(source).hexdigest()
+
+
+class NoticeManifest:
+    """
+    Notices of a package already indexed or discarded, by name, with the hash of their content. It is saved to a JSON
+    file while the package is not completed, so a rerun only processes the notices that are missing or have changed.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.notices = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as file:
+                    self.notices = json.load(file)
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable manifest {path}: {e}")
+
+    def __len__(self):
+        return len(self.notices)
+
+    def unchanged(self, name, digest):
+        entry = self.notices.get(name)
+        return entry is not None and entry['hash'] == digest
+
+    def record(self, name, digest, doc_id=None):
+        self.notices[name] = {'hash': digest, '_id': doc_id}
+
+    def save(self):
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(self.notices, file)
+        os.replace(temp_path, self.path)  # A crash while saving keeps the previous manifest
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
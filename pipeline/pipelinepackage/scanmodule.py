@@ -0,0 +1,239 @@
+#This module groups the reading of the raw indices (ted-xml, ted-eforms) by the processing pipelines: pages of a whole
+#index or of one slice of it, processed into procure_v5 by one worker process per slice.
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import threading
+import os
+from opensearchpy import OpenSearch
+from pipelinepackage.bulkmodule import record_ndjson, expand_serialized
+from pipelinepackage.csvmodule import CsvLookup, SNAPSHOT_FOLDER
+from pipelinepackage.statusmodule import processed_ids, index_and_mark, retryable_failures, ProcessingWatermark
+from pipelinepackage.stagemodule import run_stages, start_process_pool
+
+SCROLL_SIZE = 1000  # Documents per page
+SCROLL_KEEP_ALIVE = "10m"  # Renewed by every scroll request, so it only has to cover the processing of a few pages
+STAGE_QUEUE_SIZE = 2  # Pages waiting between two stages of a slice
+
+_FORKED_LOOKUP = None  # CsvLookup built by process_index before forking the slice processes, inherited by them
+
+
+class ProcessedNotice:
+    """
+    procure_v5 document of a notice, filled in by the process_hit functions of the extraction modules and streamed
+    into the bulk requests by bulkmodule.record_ndjson. FIELDS maps each attribute to its field in the document.
+    """
+    FIELDS = (("doc_id", "Document ID"), ("title", "Title"), ("title_translated", "Title (Translation)"),
+              ("description", "Description"), ("description_translated", "Description (Translation)"),
+              ("date_dispatch", "Dispatch Date"), ("cpv", "CPV"), ("cpv_desc", "CPV Description"),
+              ("health_cpv", "Healthcare CPV"), ("critical_cpv", "Critical Services CPV"), ("country", "Country"),
+              ("value", "Value"), ("c_nature", "Contract Nature"), ("proc_route", "Procurement Route"),
+              ("proc_type", "Procurement Type"), ("proc_technique", "Procurement Techniques"),
+              ("health_ca_class", "Healthcare Authority Class"), ("ca_data", "Contracting Authority"),
+              ("number_of_lots", "Number of Lots"), ("lot_data", "Lots"), ("awards_data", "Awarded Contracts"),
+              ("tags", "Tags"))
+    __slots__ = tuple(attribute for attribute, field in FIELDS)
+
+    def __init__(self, **values):
+        for attribute in self.__slots__:
+            setattr(self, attribute, values.pop(attribute))  # KeyError when a field is missing
+        if values:
+            raise TypeError(f"Unknown ProcessedNotice fields: {', '.join(values)}")
+
+    def document(self):
+        """_source of the notice in procure_v5, without the Document ID (its _id)."""
+        return {field: getattr(self, attribute) for attribute, field in self.FIELDS[1:]}
+
+
+class ScrollPages:
+    """
+    Iterable over the pages of hits of index matching query, read from a scroll context that is cleared once the
+    last page is read or close() is called (also at the end of a with block). close() may be called from another
+    thread than the one iterating, e.g. while a stage is still fetching. With slices > 1 only the slice slice_id of
+    the index is read, so several processes can read it at the same time (slices are cheapest with one per shard).
+    """
+    def __init__(self, client, index, query, size=SCROLL_SIZE, keep_alive=SCROLL_KEEP_ALIVE, slice_id=None, slices=1):
+        self.client = client
+        self.index = index
+        self.body = {"query": query, "sort": ["_doc"]}  # Index order, the fastest one to scroll
+        if slices > 1:
+            self.body["slice"] = {"id": slice_id, "max": slices}
+        self.size = size
+        self.keep_alive = keep_alive
+        self.scroll_id = None
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def __iter__(self):
+        response = self.client.search(index=self.index, body=self.body, size=self.size, scroll=self.keep_alive)
+        while self._track(response):
+            hits = response["hits"]["hits"]
+            if hits:
+                yield hits
+            if len(hits) < self.size:
+                break
+            response = self.client.scroll(scroll_id=self.scroll_id, scroll=self.keep_alive)
+        self.close()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+        self._clear()
+
+    def _track(self, response):
+        """Keeps the scroll id of response. False when closed meanwhile, the scroll is then cleared."""
+        with self.lock:
+            self.scroll_id = response.get("_scroll_id", self.scroll_id)
+            closed = self.closed
+        if closed:
+            self._clear()
+        return not closed
+
+    def _clear(self):
+        with self.lock:
+            scroll_id, self.scroll_id = self.scroll_id, None
+        if scroll_id:
+            try:
+                self.client.clear_scroll(scroll_id=scroll_id)
+            except Exception as e:
+                print(f"Could not clear the scroll of {self.index}: {e}")
+
+
+def default_slices(client, index):
+    """Slices of a parallel run over index: one per primary shard, at most one per core of this host."""
+    settings = client.indices.get_settings(index=index, name="index.number_of_shards")
+    shards = sum(int(index_settings["settings"]["index"]["number_of_shards"]) for index_settings in settings.values())
+    return max(1, min(shards, os.cpu_count() or 1))
+
+
+def extract_records(process_hit, hits, csv_sources):
+    """
+    ProcessedNotice records of the hits that could be extracted with process_hit(hit, csv_sources). Runs in the
+    transform processes. A notice raising an error is reported and skipped, as the ones process_hit discards: it
+    does not fail the rest of the page nor hold back the watermark, as it would fail again on every run.
+    """
+    records = []
+    for hit in hits:
+        try:
+            record = process_hit(hit, csv_sources)
+        except Exception as e:
+            print(f"Error extracting notice {hit['_id']}: {e}")
+            continue
+        if record is not None:
+            records.append(record)
+    return records
+
+
+def transform_page(client, hits, process_hit, csv_lookup, executor=None):
+    """
+    Extracts the notices of a page of hits not processed yet, in executor (a process pool) when given.
+    Returns (hits, ProcessedNotice records), or (hits, None) when the page could not be transformed (ted-csv or
+    pipeline_status lookups, or the transform process, failing), so it is processed again on the next run.
+    """
+    doc_ids = [hit["_id"] for hit in hits]
+    try:
+        # ted-csv fields of the whole page: snapshot lookups, and a single mget for the years not in the snapshot
+        csv_sources = csv_lookup.get_many(doc_ids)
+        processed = processed_ids(client, doc_ids)  # One mget per page
+        pending = [hit for hit in hits if hit["_id"] not in processed]
+        if executor is None:
+            records = extract_records(process_hit, pending, csv_sources)
+        else:
+            records = executor.submit(extract_records, process_hit, pending, csv_sources).result()
+    except Exception as e:
+        print(f"Error transforming a page of {len(hits)} notices: {e}")
+        return hits, None
+    return hits, records
+
+
+def index_page(client, page, index, watermark):
+    """
+    Indexes a transformed page into index with a single bulk request and marks its notices as processed.
+    Pages must be indexed one at a time (by a single thread), as the watermark keeps the timestamps of the current
+    page between seen() and failed(). They arrive in any order from the transform threads, which the watermark
+    allows: it only keeps the newest and the oldest failed timestamps. Returns (notices extracted, indexed ids).
+    """
+    hits, records = page
+    watermark.seen(hits)
+    if records is None:  # Not transformed: left unmarked, and the watermark kept before them for the next run
+        watermark.failed([hit["_id"] for hit in hits])
+        return 0, []
+    doc_ids = [record.doc_id for record in records]
+    actions = record_ndjson(records, index)
+    # Only the notices indexed in this bulk are marked as processed, with a bulk on pipeline_status
+    indexed_ids, errors = index_and_mark(client, actions, doc_ids, index=index,
+                                         expand_action_callback=expand_serialized)
+    # Only retryable failures keep the watermark before them, notices rejected for good are reported and passed
+    watermark.failed(retryable_failures(doc_ids, indexed_ids, errors))
+    return len(records), indexed_ids
+
+
+def process_slice(client_settings, source_index, index, query, process_hit, slice_id=None, slices=1,
+                  size=SCROLL_SIZE, transform_workers=0, snapshot_folder=SNAPSHOT_FOLDER):
+    """
+    Processes the notices of source_index matching query (only the slice slice_id with slices > 1) into index.
+    The pages go through overlapping stages connected by queues of STAGE_QUEUE_SIZE pages: fetched by the scroll,
+    transformed by transform_workers processes (in a thread of this process with 0), and indexed. The processes are
+    started before the stage threads, see stagemodule.start_process_pool.
+    The client (OpenSearch(**client_settings)) is its own, so it can run in a worker process. The csv lookup is the
+    one process_index built before forking it, or loaded from snapshot_folder when run on its own.
+    Returns the (newest, oldest failed) ingestion timestamps seen, for ProcessingWatermark.merge.
+    """
+    client = OpenSearch(**client_settings)
+    csv_lookup = (CsvLookup(snapshot_folder) if _FORKED_LOOKUP is None else _FORKED_LOOKUP).bind(client)
+    watermark = ProcessingWatermark(client, source_index)
+    label = source_index if slices <= 1 else f"{source_index} slice {slice_id + 1}/{slices}"
+    executor = start_process_pool(transform_workers) if transform_workers > 0 else None
+    stages = [
+        (lambda hits: transform_page(client, hits, process_hit, csv_lookup, executor), max(transform_workers, 1)),
+        (lambda page: index_page(client, page, index, watermark), 1)
+    ]
+    # Also clears the scroll when a stage fails or the run is interrupted
+    with ScrollPages(client, source_index, query, size, slice_id=slice_id, slices=slices) as pages:
+        try:
+            for scr, (hits, result, error) in enumerate(run_stages(pages, stages, STAGE_QUEUE_SIZE), start=1):
+                if error is not None:
+                    raise error
+                extracted, indexed_ids = result
+                print(f"{label}, scroll {scr}: indexed {len(indexed_ids)} documents, "
+                      f"failed to index {extracted - len(indexed_ids)} documents.")
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+    return watermark.newest, watermark.oldest_failed
+
+
+def process_index(client_settings, source_index, index, query, process_hit, slices=1, transform_workers=0,
+                  snapshot_folder=SNAPSHOT_FOLDER, **kwargs):
+    """
+    Runs process_slice over source_index: in this process with slices=1, otherwise in one worker process per slice
+    (process_hit must be a module-level function, so it can be sent to them). Returns the results of the slices.
+    A failing slice raises its error once the other ones are finished.
+    Slices and their transform processes are capped to the cores of this host, and the csv lookup is loaded once,
+    before the slice processes are forked, so they share its arrays instead of loading one each.
+    """
+    global _FORKED_LOOKUP
+    cores = os.cpu_count() or 1
+    if slices > cores or slices * transform_workers > cores:
+        slices = min(slices, cores)
+        transform_workers = min(transform_workers, cores // slices) if slices < cores else 0
+        print(f"Processing capped to {cores} cores: {slices} slices of {transform_workers} transform processes")
+    kwargs.update(transform_workers=transform_workers, snapshot_folder=snapshot_folder)
+    if slices <= 1:
+        return [process_slice(client_settings, source_index, index, query, process_hit, **kwargs)]
+    _FORKED_LOOKUP = CsvLookup(snapshot_folder)
+    # Forked from this thread before any other is started; with another start method each slice loads its lookup
+    context = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+    try:
+        with ProcessPoolExecutor(max_workers=slices, mp_context=context) as executor:
+            futures = [executor.submit(process_slice, client_settings, source_index, index, query, process_hit,
+                                       slice_id, slices, **kwargs)
+                       for slice_id in range(slices)]
+            return [future.result() for future in futures]
+    finally:
+        _FORKED_LOOKUP = None
@@ -0,0 +1,90 @@
+#This module groups the helpers to run pipeline steps concurrently (e.g. download, extract and upload of different packages at the same time).
+import threading
+import queue
+from concurrent.futures import ProcessPoolExecutor
+
+_DONE = object()  # End of stream marker passed through the queues
+
+
+def start_process_pool(workers):
+    """
+    ProcessPoolExecutor of workers processes, all started before returning. Pools used by the stages must be created
+    this way before run_stages starts its threads: the workers of a pool are otherwise forked on the first submit,
+    from a stage thread, while other threads may hold locks (logging, queues, HTTP connections) that stay locked in
+    the child and deadlock it.
+    """
+    executor = ProcessPoolExecutor(max_workers=workers)
+    for future in [executor.submit(int) for _ in range(workers)]:
+        future.result()
+    return executor
+
+
+def run_stages(items, stages, queue_size=2, ordered=True):
+    """
+    Runs every item through stages, a list of (function, workers) pairs. Each stage runs in its own threads and is
+    connected to the next one by a queue of queue_size items, so stage k works on item n while stage k-1 already
+    works on item n+1 and the reading of items never runs far ahead of the slowest stage.
+    Yields (item, result, error) tuples: result is the output of the last stage, or error the exception raised by
+    the first failing stage (later stages are skipped for that item). With ordered=True the tuples are yielded in
+    the same order as items, otherwise as soon as they are finished.
+    """
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+    feed_errors = []
+
+    def feed():
+        try:
+            for seq, item in enumerate(items):
+                queues[0].put((seq, item, item, None))
+        except Exception as e:
+            feed_errors.append(e)
+        finally:
+            for _ in range(stages[0][1]):
+                queues[0].put(_DONE)
+
+    def make_worker(k, function):
+        finished = [0]
+        lock = threading.Lock()
+        next_workers = stages[k + 1][1] if k + 1 < len(stages) else 1
+
+        def work():
+            while True:
+                task = queues[k].get()
+                if task is _DONE:
+                    break
+                seq, item, value, error = task
+                if error is None:
+                    try:
+                        value = function(value)
+                    except Exception as e:
+                        value, error = None, e
+                queues[k + 1].put((seq, item, value, error))
+            with lock:  # The last worker of the stage closes the next one
+                finished[0] += 1
+                if finished[0] == stages[k][1]:
+                    for _ in range(next_workers):
+                        queues[k + 1].put(_DONE)
+        return work
+
+    threads = [threading.Thread(target=feed, daemon=True)]
+    for k, (function, workers) in enumerate(stages):
+        work = make_worker(k, function)  # Shared by the stage threads, so they count each other when finishing
+        threads += [threading.Thread(target=work, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+
+    pending = {}
+    next_seq = 0
+    while True:
+        task = queues[-1].get()
+        if task is _DONE:
+            break
+        seq, item, value, error = task
+        if not ordered:
+            yield item, value, error
+            continue
+        pending[seq] = (item, value, error)
+        while next_seq in pending:
+            yield pending.pop(next_seq)
+            next_seq += 1
+    if feed_errors:
+        raise feed_errors[0]
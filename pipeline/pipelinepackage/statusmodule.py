@@ -0,0 +1,147 @@
+#This module groups the pipeline_status bookkeeping of the processing pipelines, batched per scroll page.
+from datetime import datetime, timedelta, timezone
+from opensearchpy import helpers
+from opensearchpy.exceptions import NotFoundError
+
+STATUS_INDEX = "pipeline_status"
+PROCESSING_PREFIX = "processing-"  # pipeline_status documents of the processed notices are processing-<doc id>
+INGESTION_TIMESTAMP_FIELD = "ingestion_timestamp"  # Set by the ingestion on every raw notice (ted-xml, ted-eforms)
+WATERMARK_OVERLAP = timedelta(hours=1)  # Documents ingested this long before the watermark are selected again
+
+
+def ingestion_timestamp():
+    """Value of INGESTION_TIMESTAMP_FIELD for a notice indexed now (UTC ISO 8601, ordered as strings)."""
+    return datetime.now(timezone.utc).isoformat()
+
+
+def processed_ids(client, doc_ids):
+    """IDs of doc_ids already marked as processed, checked with a single mget."""
+    if not doc_ids:
+        return set()
+    response = client.mget(index=STATUS_INDEX, body={"ids": [PROCESSING_PREFIX + doc_id for doc_id in doc_ids]},
+                           _source=False)
+    return {doc["_id"][len(PROCESSING_PREFIX):] for doc in response["docs"] if doc.get("found")}
+
+
+def mark_processed(client, doc_ids):
+    """Marks doc_ids as processed with a single bulk request. Returns the number of status documents written."""
+    timestamp = datetime.now()
+    actions = [
+        {
+            "_op_type": "index",
+            "_index": STATUS_INDEX,
+            "_id": PROCESSING_PREFIX + doc_id,
+            "_source": {  # In _source, as pipeline is also the name of a bulk metadata field
+                "pipeline": "processing",
+                "doc_id": doc_id,
+                "timestamp": timestamp
+            }
+        }
+        for doc_id in doc_ids
+    ]
+    if not actions:
+        return 0
+    success, errors = helpers.bulk(client, actions, raise_on_error=False)
+    for error in errors:
+        item = error[next(iter(error))]
+        print(f"Failed to mark {item.get('_id')} as processed: {item.get('error')}")
+    return success
+
+
+def index_and_mark(client, actions, doc_ids, **bulk_kwargs):
+    """
+    Sends the bulk actions of a page with helpers.bulk, then marks as processed only the doc_ids that were indexed
+    (a failed item, or a failed request, leaves its notices unmarked so they are processed again).
+    Returns (indexed ids, errors).
+    """
+    try:
+        success, errors = helpers.bulk(client, actions, raise_on_error=False, **bulk_kwargs)
+    except Exception as e:
+        print(f"Error during bulk indexing: {e}")
+        return [], [e]
+    failed_ids = {error[next(iter(error))].get('_id') for error in errors}
+    indexed_ids = [doc_id for doc_id in doc_ids if doc_id not in failed_ids]
+    mark_processed(client, indexed_ids)
+    return indexed_ids, errors
+
+
+def retryable_failures(doc_ids, indexed_ids, errors):
+    """
+    IDs of doc_ids that index_and_mark did not index for a reason that may pass on the next run: a failed request,
+    or items rejected with 429 or a 5xx status. Items rejected for good (other 4xx, e.g. mapping conflicts) would
+    fail again on every run, they are reported and not returned, so they do not hold back the watermark.
+    """
+    indexed = set(indexed_ids)
+    failed_ids = [doc_id for doc_id in doc_ids if doc_id not in indexed]
+    if any(not isinstance(error, dict) for error in errors):  # The whole request failed
+        return failed_ids
+    items = {item.get('_id'): item for item in (error[next(iter(error))] for error in errors)}
+    retryable = []
+    for doc_id in failed_ids:
+        status = items.get(doc_id, {}).get('status')
+        if status is None or status == 429 or status >= 500:
+            retryable.append(doc_id)
+        else:
+            print(f"{doc_id} rejected ({status}), not retried: {items[doc_id].get('error')}")
+    return retryable
+
+
+class ProcessingWatermark:
+    """
+    High-water mark of the ingestion timestamps processed from a raw index, persisted in pipeline_status as
+    processing-watermark-<index>. query() selects the notices ingested since the last run (all of them on the first
+    run), going back WATERMARK_OVERLAP so notices made visible late by a running ingestion are not missed; the ones
+    already processed are skipped by the page-level check.
+    The hits of each page are passed to seen(), the IDs that failed to index for a retryable reason to failed() (see
+    retryable_failures), and save() stores the newest timestamp seen, or the oldest one of a failed notice so it is
+    selected again on the next run. The watermarks of parallel slices are combined with merge(newest, oldest_failed)
+    before saving.
+    """
+    def __init__(self, client, source_index, overlap=WATERMARK_OVERLAP):
+        self.client = client
+        self.source_index = source_index
+        self.doc_id = f"{PROCESSING_PREFIX}watermark-{source_index}"
+        self.overlap = overlap
+        self.timestamps = {}  # Ingestion timestamp of the notices of the current page, by ID
+        self.newest = None
+        self.oldest_failed = None
+        try:
+            self.value = client.get(index=STATUS_INDEX, id=self.doc_id)["_source"]["watermark"]
+        except NotFoundError:
+            self.value = None
+
+    def query(self):
+        if self.value is None:
+            return {"match_all": {}}
+        start = datetime.fromisoformat(self.value) - self.overlap
+        return {"range": {INGESTION_TIMESTAMP_FIELD: {"gte": start.isoformat()}}}
+
+    def seen(self, hits):
+        self.timestamps = {hit["_id"]: hit["_source"].get(INGESTION_TIMESTAMP_FIELD) for hit in hits}
+        self.merge(max((timestamp for timestamp in self.timestamps.values() if timestamp), default=None), None)
+
+    def failed(self, doc_ids):
+        timestamps = [self.timestamps[doc_id] for doc_id in doc_ids if self.timestamps.get(doc_id)]
+        self.merge(None, min(timestamps, default=None))
+
+    def merge(self, newest, oldest_failed):
+        """Adds the newest and oldest failed timestamps of another watermark (e.g. of a slice run in a worker process)."""
+        if newest and (self.newest is None or newest > self.newest):
+            self.newest = newest
+        if oldest_failed and (self.oldest_failed is None or oldest_failed < self.oldest_failed):
+            self.oldest_failed = oldest_failed
+
+    def save(self):
+        if self.oldest_failed is not None:
+            mark = self.oldest_failed
+        else:  # Never moved back by a run that only saw the overlap
+            mark = max((timestamp for timestamp in (self.newest, self.value) if timestamp), default=None)
+        if mark is None or mark == self.value:
+            return
+        self.client.index(index=STATUS_INDEX, id=self.doc_id, body={
+            "pipeline": "processing",
+            "index": self.source_index,
+            "watermark": mark,
+            "timestamp": datetime.now()
+        })
+        self.value = mark
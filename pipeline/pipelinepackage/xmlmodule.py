@@ -0,0 +1,357 @@
+#This module groups the functions to parse and preformat TED XML notices (legacy TED schema and eForms).
+from xml.parsers import expat
+import xmltodict
+import traceback
+import json
+
+# Subtrees of a notice that format_dict keeps. A dict describes an element whose children are filtered by name,
+# None means the whole subtree is kept. Everything else is skipped by the streaming parser without being built.
+KEPT_PATHS = {
+    "TED_EXPORT": {
+        "CODED_DATA_SECTION": None,
+        "FORM_SECTION": {"F03_2014": None}
+    },
+    "ContractAwardNotice": None
+}
+PEEK_CHUNK = 4096  # Bytes read at a time by classify_notice
+PEEK_LIMIT = 16384  # Bytes after which classify_notice gives up and the notice is fully parsed
+_END = object()  # Exhausted iterator marker of flatten_p_text
+
+
+def flatten_p_text(value):
+    """
+    Text of a P field: lists are joined with new lines and dicts without #text with '; '. Iterative and join based,
+    same result as the former recursive fetch_p_text.
+    """
+    frames = []  # (separator, parts, pending children) of the lists and dicts being flattened
+    while True:
+        if isinstance(value, list):
+            frames.append(("\n", [], iter(value)))
+        elif isinstance(value, dict) and "#text" not in value:
+            frames.append(("; ", [], iter(value.values())))
+        else:
+            if value is None:
+                text = ""
+            elif isinstance(value, dict):
+                text = value["#text"]
+            else:
+                text = value
+            if not frames:
+                return text
+            frames[-1][1].append(text)
+        while True:  # Next pending child, closing the frames that are complete
+            separator, parts, children = frames[-1]
+            value = next(children, _END)
+            if value is not _END:
+                break
+            frames.pop()
+            text = separator.join(parts)
+            if not frames:
+                return text
+            frames[-1][1].append(text)
+
+
+def normalise_notice(notice, flatten_p=False, collapse_text=False, strip_root_attributes=False):
+    """
+    Normalises a parsed notice in a single iterative traversal (modified in place):
+    - flatten_p replaces every element holding P paragraphs by their text (legacy TED schema),
+    - collapse_text replaces every element holding a #text by that text, the last one for lists (eForms),
+    - strip_root_attributes drops the @ keys (namespace declarations) of the root, returning a new root dict.
+    The results are the same as the former recursive modify_p_fields and modify_txt_fields.
+    """
+    if collapse_text and not flatten_p:
+        _collapse_text(notice)
+    else:
+        _normalise(notice, flatten_p, collapse_text)
+    if strip_root_attributes:
+        return {k: v for k, v in notice.items() if not k.startswith('@')}
+    return notice
+
+
+def _collapse_text(notice):
+    """
+    collapse_text pass of normalise_notice on its own (eForms notices): no P elements to defer, so every element is
+    handled in a single visit, with exact type checks and the stack methods bound once.
+    """
+    stack = [element for element in notice if type(element) is dict] if type(notice) is list else [notice]
+    pop = stack.pop
+    push = stack.append
+    extend = stack.extend
+    while stack:
+        element = pop()
+        for key, value in element.items():
+            value_type = type(value)
+            if value_type is dict:
+                if "#text" in value:
+                    element[key] = value["#text"]
+                elif value:
+                    push(value)
+            elif value_type is list:
+                for item in reversed(value):  # The last #text of a list wins
+                    if type(item) is dict and "#text" in item:
+                        element[key] = item["#text"]
+                        break
+                else:
+                    extend([item for item in value if type(item) is dict])
+
+
+def _normalise(notice, flatten_p, collapse_text):
+    stack = [notice]
+    while stack:
+        task = stack.pop()
+        if not isinstance(task, dict):
+            if isinstance(task, tuple):  # Deferred P flattening of an element normalised in the meantime
+                container, key, element = task
+                container[key] = flatten_p_text(element["P"])
+            else:  # List root
+                stack.extend(element for element in task if isinstance(element, dict))
+            continue
+        for key, value in task.items():
+            if isinstance(value, dict):
+                if collapse_text and "#text" in value:
+                    task[key] = value["#text"]
+                elif flatten_p and "P" in value:
+                    if next(iter(value)) == "P":
+                        task[key] = flatten_p_text(value["P"])
+                    else:  # Keys before P: the element is normalised before its P text is read
+                        stack.append((task, key, value))
+                        stack.append(value)
+                elif value:
+                    stack.append(value)
+            elif isinstance(value, list):
+                elements = [element for element in value if isinstance(element, dict)]
+                if collapse_text:
+                    for element in reversed(elements):
+                        if "#text" in element:
+                            task[key] = element["#text"]
+                            break
+                    else:
+                        stack.extend(elements)
+                else:
+                    stack.extend(elements)
+
+
+# Preformats the xml, selecting only Contract Award Notices and preformatting P text fields so opensearch may index them as they had a variable structure.
+def format_dict(notice):
+    is_eforms = True
+    if "TED_EXPORT" in notice:
+        notice = notice["TED_EXPORT"]
+    if "CODED_DATA_SECTION" in notice:
+        is_eforms = False
+        try:
+            doc_ojs = notice["CODED_DATA_SECTION"]["NOTICE_DATA"]["NO_DOC_OJS"]
+            notice_id = doc_ojs.split("-")[-1].zfill(8) + "-" + doc_ojs[:4]
+            notice_clean = {
+                "CODED_DATA_SECTION": notice["CODED_DATA_SECTION"],
+                "CONTRACT_AWARD_NOTICE": notice["FORM_SECTION"]["F03_2014"]
+            }
+            notice_clean = normalise_notice(notice_clean, flatten_p=True)
+        except KeyError as e:
+            raise
+
+    else:  # "ContractAwardNotice" in notice:
+        try:
+            notice_clean = notice['ContractAwardNotice']
+            notice_id = \
+            notice_clean['ext:UBLExtensions']['ext:UBLExtension']['ext:ExtensionContent']['efext:EformsExtension'][
+                'efac:Publication']['efbc:NoticePublicationID']['#text']
+            notice_clean = normalise_notice(notice_clean, collapse_text=True, strip_root_attributes=True) #Clean namespace tags
+        except KeyError as e:
+            raise
+    return is_eforms, notice_id, notice_clean
+
+
+def process_notice(source, parser_mode="stream", preclassify=True):
+    """
+    Classifies, parses and formats a single notice. It runs in the ingestion worker processes, so it returns a
+    picklable (status, is_eforms, notice_id, notice, error) tuple, status being 'success', 'discarded' or 'failed'.
+    is_eforms is None when the notice failed outside of format_dict key lookups.
+    """
+    if preclassify and classify_notice(source)[0] is False:
+        return 'discarded', False, None, None, 'Not CAN'
+    xml_dict = parse_notice(source, parser_mode)
+    try:
+        is_eforms, notice_id, notice = format_dict(xml_dict)
+        return 'success', is_eforms, notice_id, notice, None
+    except KeyError as keyerror:
+        if keyerror.args[0] in ('F03_2014', 'ContractAwardNotice'):
+            return 'discarded', False, None, None, 'Not CAN'
+        print(f"exception{keyerror}")
+        return 'failed', False, None, None, 'Key Error:' + str(keyerror)
+    except Exception as e:
+        print(e)
+        traceback.print_exc()
+        print(json.dumps(xml_dict, indent=4))
+        return 'failed', None, None, None, 'Error:' + str(e)
+
+
+class _StreamingNoticeHandler:
+    """
+    Expat handler that builds the same dict tree as xmltodict.parse (default options), but only for the subtrees
+    listed in kept_paths. Skipped elements are never materialised, so their text and children are dropped as they
+    are read.
+    """
+    def __init__(self, kept_paths):
+        self.rules = [kept_paths]  # Children filter of each open element, None inside a fully kept subtree
+        self.skip_depth = 0  # > 0 while inside an element that is not kept
+        self.stack = []
+        self.item = None
+        self.data = []
+
+    def start_element(self, name, attrs):
+        if self.skip_depth:
+            self.skip_depth += 1
+            return
+        rule = self.rules[-1]
+        if rule is not None:
+            if name in rule:
+                rule = rule[name]
+            elif len(self.rules) == 1:  # Unknown root (not a CAN): kept empty so format_dict discards it as before
+                rule = {}
+            else:
+                self.skip_depth = 1
+                return
+        self.rules.append(rule)
+        self.stack.append((self.item, self.data))
+        self.item = {'@' + key: value for key, value in zip(attrs[0::2], attrs[1::2])} or None
+        self.data = []
+
+    def end_element(self, name):
+        if self.skip_depth:
+            self.skip_depth -= 1
+            return
+        rule = self.rules.pop()
+        data = "".join(self.data) if self.data else None
+        item = self.item
+        self.item, self.data = self.stack.pop()
+        if data:
+            data = data.strip() or None
+        if rule is not None:  # Filtered ancestor: always a dict, so missing children raise KeyError in format_dict
+            data = None
+            if item is None:
+                item = {}
+        if item is not None:
+            if data:
+                self.push_data(item, '#text', data)
+            self.item = self.push_data(self.item, name, item)
+        else:
+            self.item = self.push_data(self.item, name, data)
+
+    def characters(self, data):
+        if not self.skip_depth:
+            self.data.append(data)
+
+    @staticmethod
+    def push_data(item, key, data):
+        if item is None:
+            item = {}
+        if key in item:
+            value = item[key]
+            if isinstance(value, list):
+                value.append(data)
+            else:
+                item[key] = [value, data]
+        else:
+            item[key] = data
+        return item
+
+
+def _forbid_entities(*args, **kwargs):
+    raise ValueError("entities are disabled")
+
+
+def stream_parse(source, kept_paths=KEPT_PATHS):
+    """Event-based parse of a notice (path, bytes or binary file object), building only the kept subtrees."""
+    handler = _StreamingNoticeHandler(kept_paths)
+    parser = expat.ParserCreate('utf-8')  # Same parser settings as xmltodict.parse on a decoded string
+    parser.ordered_attributes = True
+    parser.buffer_text = True
+    parser.StartElementHandler = handler.start_element
+    parser.EndElementHandler = handler.end_element
+    parser.CharacterDataHandler = handler.characters
+    parser.EntityDeclHandler = _forbid_entities
+    if isinstance(source, (bytes, bytearray)):
+        parser.Parse(source, True)
+    elif hasattr(source, 'read'):
+        parser.ParseFile(source)
+    else:
+        with open(source, 'rb') as file:
+            parser.ParseFile(file)
+    return handler.item
+
+
+def parse_notice(source, mode="stream"):
+    """
+    Parses a notice into the dict tree expected by format_dict. mode="xmltodict" builds the whole document,
+    mode="stream" only builds the parts format_dict keeps and produces the same formatted documents.
+    """
+    if mode == "stream":
+        return stream_parse(source)
+    elif mode == "xmltodict":
+        if isinstance(source, (bytes, bytearray)):
+            xml_data = source.decode('utf-8')
+        elif hasattr(source, 'read'):
+            xml_data = source.read()
+        else:
+            with open(source, 'r', encoding='utf-8') as file:
+                xml_data = file.read()
+        return xmltodict.parse(xml_data)
+    else:
+        raise ValueError(f"Unknown XML parser mode '{mode}'")
+
+
+class _NoticeClassified(Exception):
+    pass
+
+
+class _NoticeClassifier:
+    """
+    Expat handler that stops the parse as soon as the notice root or legacy form is known, with the same rules as
+    format_dict: the ContractAwardNotice root (eForms) or an F03_2014 child of FORM_SECTION (legacy schema).
+    """
+    def __init__(self):
+        self.path = []
+        self.notice_type = None
+
+    def start_element(self, name, attrs):
+        if not self.path and name != "TED_EXPORT":  # eForms notices are identified by their root element
+            self.notice_type = name
+            raise _NoticeClassified(name == "ContractAwardNotice")
+        if self.path and self.path[-1] == "FORM_SECTION":  # Legacy form (F03_2014 is the only one format_dict keeps)
+            self.notice_type = name
+            raise _NoticeClassified(name == "F03_2014")
+        self.path.append(name)
+
+    def end_element(self, name):
+        self.path.pop()
+
+
+def classify_notice(source, peek_limit=PEEK_LIMIT):
+    """
+    Reads at most peek_limit bytes of a notice (path or bytes) to tell whether it is a Contract Award Notice.
+    Returns (is_can, notice_type). is_can is False only for notices format_dict would discard, and None when
+    the head of the file is not enough to decide, in which case the notice must be fully parsed.
+    """
+    handler = _NoticeClassifier()
+    parser = expat.ParserCreate('utf-8')
+    parser.ordered_attributes = True
+    parser.StartElementHandler = handler.start_element
+    parser.EndElementHandler = handler.end_element
+    try:
+        if isinstance(source, (bytes, bytearray)):
+            for start in range(0, min(len(source), peek_limit), PEEK_CHUNK):
+                parser.Parse(source[start:start + PEEK_CHUNK], False)
+        else:
+            with open(source, 'rb') as file:
+                read = 0
+                while read < peek_limit:
+                    chunk = file.read(PEEK_CHUNK)
+                    if not chunk:
+                        break
+                    parser.Parse(chunk, False)
+                    read += len(chunk)
+    except _NoticeClassified as classified:
+        return classified.args[0], handler.notice_type
+    except expat.ExpatError:
+        pass  # Malformed head, left to the full parser to report
+    return None, handler.notice_type
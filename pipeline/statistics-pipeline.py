@@ -2,11 +2,13 @@ from opensearchpy import OpenSearch, helpers
 import pandas as pd
 import os
 import getpass
+from pipelinepackage.bulkmodule import frame_ndjson, expand_serialized, BulkLoadMode
 #                               ------------ CONSTANTS -----------------
 FOLDER = "../../data/oecd-eurostat/"
 HOST = 'localhost'
 PORT = 9200
 INDEX = 'oecd-eurostat'
+DROP_REPLICAS = False  # Also remove the replicas of INDEX while loading, they are rebuilt at the end
 username = input("Enter ProCureSpot username: ")
 password = getpass.getpass(prompt="Enter ProCureSpot password: ")
 auth = (username, password)
@@ -69,45 +71,37 @@ legend = {
 #                                   ---------CODE---------
 dfs = []
 stat_files = [stat_file for stat_file in os.listdir(FOLDER)]
-for csv_file in stat_files:
-    file_path = os.path.join(FOLDER, csv_file)
-    df = pd.read_csv(file_path, sep=';', decimal=',')
-    if csv_file == "Health exp by scheme.csv":
-        df['ID'] = csv_file[:-4].replace(" ", "") + "_" + df['FINANCING_SCHEME'] + "_" + df['ID']
-    elif csv_file == "Health exp Government  Compulsory financing schemes.csv":
-        df['ID'] = csv_file[:-4].replace(" ", "") + "_" + df['UNIT_MEASURE'] + "_" + df['ID']
-    elif csv_file == "Health exp by services.csv":
-        df['ID'] = csv_file[:-4].replace(" ", "") + "_" + df['FUNCTION'] + "_" + df['ID']
-    elif csv_file == "Health exp by providers.csv":
-        df['ID'] = csv_file[:-4].replace(" ", "") + "_" + df['PROVIDER'] + "_" + df['ID']
-    else:
-        df['ID'] = csv_file[:-4].replace(" ", "") + "_" + df['ID']
+with BulkLoadMode(client, INDEX, drop_replicas=DROP_REPLICAS):  # No refreshes while loading, one at the end
+    for csv_file in stat_files:
+        file_path = os.path.join(FOLDER, csv_file)
+        df = pd.read_csv(file_path, sep=';', decimal=',')
+        if csv_file == "Health exp by scheme.csv":
+            df['ID'] = csv_file[:-4].replace(" ", "") + "_" + df['FINANCING_SCHEME'] + "_" + df['ID']
+        elif csv_file == "Health exp Government  Compulsory financing schemes.csv":
+            df['ID'] = csv_file[:-4].replace(" ", "") + "_" + df['UNIT_MEASURE'] + "_" + df['ID']
+        elif csv_file == "Health exp by services.csv":
+            df['ID'] = csv_file[:-4].replace(" ", "") + "_" + df['FUNCTION'] + "_" + df['ID']
+        elif csv_file == "Health exp by providers.csv":
+            df['ID'] = csv_file[:-4].replace(" ", "") + "_" + df['PROVIDER'] + "_" + df['ID']
+        else:
+            df['ID'] = csv_file[:-4].replace(" ", "") + "_" + df['ID']
 
-    df.rename(columns=legend, inplace=True)
-    df.replace(legend, inplace=True)
-    df['File'] = csv_file[:-4]
-    df = pd.merge(df, metadata, on='File', how='left')
+        df.rename(columns=legend, inplace=True)
+        df.replace(legend, inplace=True)
+        df['File'] = csv_file[:-4]
+        df = pd.merge(df, metadata, on='File', how='left')
 
-    df = df.where(pd.notna(df), 'None')
-    df = df.replace('None', None)
-
-    columns_to_drop = ['DATAFLOW', 'Health care provider', 'Financing scheme', 'UNIT_MEASURE']
-    columns_existing = [col for col in columns_to_drop if col in df.columns]
-    if columns_existing:
-        df.drop(columns=columns_existing, inplace=True)
-    actions = [
-        {
-
-            "_op_type": "index",
-            "_index": INDEX,
-            "_id": doc['ID'],
-            **{f"{col_name}": doc[col_name] for col_name in df.columns if col_name != 'ID'}
-        }
-        for _, doc in df.iterrows()
-    ]
-    try:
-        success, failed = helpers.bulk(client, actions, index=INDEX, raise_on_error=True, refresh=True)
-        print("Indexed "+csv_file)
-    except Exception as e:
-        print(f"Error during bulk indexing: {e}")
+        df = df.where(pd.notna(df), 'None')
+        df = df.replace('None', None)
 
+        columns_to_drop = ['DATAFLOW', 'Health care provider', 'Financing scheme', 'UNIT_MEASURE']
+        columns_existing = [col for col in columns_to_drop if col in df.columns]
+        if columns_existing:
+            df.drop(columns=columns_existing, inplace=True)
+        actions = frame_ndjson(df, INDEX, id_column='ID')
+        try:
+            success, failed = helpers.bulk(client, actions, index=INDEX, raise_on_error=True,
+                                           expand_action_callback=expand_serialized)
+            print("Indexed "+csv_file)
+        except Exception as e:
+            print(f"Error during bulk indexing: {e}")
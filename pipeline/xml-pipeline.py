@@ -1,26 +1,34 @@
-from opensearchpy import OpenSearch, helpers
-import pandas as pd
+from opensearchpy import OpenSearch
 import shutil
-import xmltodict
-import json
 import os
-import wget
 import tarfile
 from urllib.error import HTTPError
 import datetime
 from tqdm import tqdm
 import getpass
-import traceback
 from datetime import datetime as dt
 from pipelinepackage.auth import get_opensearch_auth
-import urllib.request
-from time import sleep
+from pipelinepackage.xmlmodule import process_notice
+from pipelinepackage.stagemodule import run_stages, start_process_pool
+from pipelinepackage.bulkmodule import BulkIndexer
+from pipelinepackage.packagemodule import iter_package_notices, notice_hash, NoticeManifest
+from pipelinepackage.packagemodule import package_url, discover_packages, probe_package
+from pipelinepackage.cachemodule import PackageCache
+from pipelinepackage.logmodule import IngestionLog
+from pipelinepackage.statusmodule import INGESTION_TIMESTAMP_FIELD, ingestion_timestamp
+from collections import deque
 from opensearchpy import RequestsHttpConnection
-from urllib3.util import Retry
 #                               ------------ CONSTANTS -----------------
-BASE_URL = 'https://ted.europa.eu/packages/daily/'
+BASE_URL = 'https://ted.europa.eu/packages/daily/'  # Or a local folder with the PACKAGES_FOLDER layout (mirror mode, no network)
 BASE_FOLDER = "./temp/xml/"
-LOGS_PATH ="./logs/xml-ingestion.csv"
+PACKAGES_FOLDER = "./cache/packages/"  # Downloaded packages, as <year>/<ojs>.tar.gz with their checksum and HTTP validators
+KEEP_PACKAGES = True  # False removes the archive of a package once it is ingested
+REVALIDATE_PACKAGES = True  # Checks cached packages with a conditional request, False uses them without any request
+LOGS_PATH = "./logs/xml-ingestion"  # xml-ingestion.csv or xml-ingestion/ parquet dataset, depending on LOGS_FORMAT
+LOGS_FORMAT = 'parquet'  # 'parquet' (partitioned by day) or 'csv'
+LOGS_FLUSH_RECORDS = 20000  # Log records buffered before being written
+LOGS_COLUMNS = ['package', '_id', '_index', 'status', 'error', 'date']
+MANIFESTS_FOLDER = "./logs/manifests/"  # Notices already indexed of the packages not completed, to resume them
 START_YEAR = 2019
 END_YEAR = datetime.date.today().year
 # Opensearch client
@@ -29,7 +37,20 @@ PORT = 9200
 auth = get_opensearch_auth()
 INDEX_XML = 'ted-xml'
 INDEX_EFORMS = 'ted-eforms'
-from time import sleep
+PACKAGE_MODE = 'stream'  # 'stream' reads notices from the downloaded gzip stream, 'disk' downloads and extracts packages in BASE_FOLDER
+XML_PARSER = 'stream'  # 'stream' builds only the CAN subtrees kept by format_dict, 'xmltodict' parses the whole notice
+PRECLASSIFY = True  # Discards non-CAN notices from the first KBs of the file, before parsing them
+XML_WORKERS = int(os.getenv("XML_WORKERS", os.cpu_count() or 1))  # Processes parsing notices, 1 parses in the main process
+# Packages handled at the same time by each ingestion stage, and packages waiting between two stages
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", 2))
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", 1))
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", 1))  # Each upload already parses with XML_WORKERS processes
+STAGE_QUEUE_SIZE = 2
+# Discovery of the packages to ingest: concurrent HEAD requests, OJS numbers probed at a time past the last ingested one
+PROBE_WORKERS = 16
+PROBE_WINDOW = 32
+MAX_OJS_PER_YEAR = 1000
+BULK_BATCH_BYTES = 5 * 2**20  # Initial size of the bulk requests, then adapted to the cluster latency
 
 OS_CLIENT = OpenSearch(
     hosts=[{'host': HOST, 'port': PORT}],
@@ -44,19 +65,13 @@ OS_CLIENT = OpenSearch(
     timeout=60,
     connection_class=RequestsHttpConnection
 )
+PACKAGE_CACHE = PackageCache(PACKAGES_FOLDER, BASE_URL, revalidate=REVALIDATE_PACKAGES)
+INGESTION_LOG = IngestionLog(LOGS_PATH, LOGS_COLUMNS, LOGS_FORMAT, flush_every=LOGS_FLUSH_RECORDS)
 
 #                          ------------ FUNCTIONS -----------------
 
 def url_exists(url):
-    try:
-        req = urllib.request.Request(url, method="HEAD")
-        with urllib.request.urlopen(req) as response:
-            return response.status == 200
-    except urllib.error.HTTPError as e:
-        return False
-    except Exception as e:
-        print(f"Error while checking URL: {e}")
-        return False
+    return probe_package(url) == 200
 
 def log_pipeline_status(client, year, ojs=None):
     timestamp = datetime.datetime.now()
@@ -72,265 +87,227 @@ def log_pipeline_status(client, year, ojs=None):
         doc["ojs"] = ojs
     client.index(index="pipeline_status", id=doc_id, body=doc)
 
-# Extracts a .tar.gz compressed file and deletes the compressed file
-def extract_file(file_path):
+# Extracts a .tar.gz compressed file (kept in the package cache) into extract_path
+def extract_file(file_path, extract_path):
     try:
         with tarfile.open(file_path, 'r:gz') as tar:
-            tar.extractall(path=file_path[:-7])
-
-        # Remove the downloaded archive file
-        os.remove(file_path)
+            tar.extractall(path=extract_path)
         print(f"Extracted: {file_path}")
 
     except Exception as e:
         print(f"Failed to extract {file_path}: {e}")
 
 
-def modify_p_fields(dictionary):
-    if isinstance(dictionary, dict):
-        for text_field, text_dictionary in dictionary.items():
-            if isinstance(text_dictionary, dict):
-                for p_field, p_value in text_dictionary.items():
-                    if p_field == 'P':
-                        # print("before: "+json.dumps(dictionary[text_field]))
-                        # if p_value is not None:
-                        #     print('---------------------------------------------------------------------------------------------------------------------------------------------------')
-                        #     print(text_field +": "+fetch_p_text(p_value))
-                        dictionary[text_field] = fetch_p_text(p_value)
-                        # print("after: "+json.dumps(dictionary[text_field]))
-                    else:
-                        modify_p_fields(text_dictionary)
-            elif isinstance(text_dictionary, list):
-                modify_p_fields(text_dictionary)
-    elif isinstance(dictionary, list):
-        for e in range(len(dictionary)):
-            if isinstance(dictionary[e], dict):
-                modify_p_fields(dictionary[e])
-
-
-def fetch_p_text(p_dictionary):
-    if p_dictionary is None:
-        return ""
-    elif isinstance(p_dictionary, str):
-        return p_dictionary
-    elif isinstance(p_dictionary, list):
-        p_text = ""
-        for item in p_dictionary:
-            p_text = p_text + "\n" + fetch_p_text(item)
-        return p_text[1:]
-    elif isinstance(p_dictionary, dict):
-        if "#text" in p_dictionary:
-            return p_dictionary["#text"]
-        else:
-            p_text = ""
-            for inner_field, inner_dictionary in p_dictionary.items():
-                p_text = p_text + "; " + fetch_p_text(inner_dictionary)
-            return p_text[2:]
-
+def generate_log(package,doc_id,index,status,error):
+    INGESTION_LOG.append(package=package, _id=doc_id, _index=index, status=status, error=error)
 
-def modify_txt_fields(dictionary):
-    if isinstance(dictionary, dict):
-        for k, v in dictionary.items():
-            if isinstance(v, dict):
-                if '#text' in v.keys():
-                    #print("before: " + json.dumps(dictionary))
-                    # if p_value is not None:
-                    #     print('---------------------------------------------------------------------------------------------------------------------------------------------------')
-                    dictionary[k] = dictionary[k]['#text']
-                    #print("after: " + json.dumps(dictionary))
-                else:
-                    modify_txt_fields(v)
-            elif isinstance(v, list):
-                for e in range(len(v)):
-                    if isinstance(v[e], dict):
-                        if '#text' in v[e].keys():
-                            dictionary[k] = v[e]['#text']
-                        else:
-                            modify_txt_fields(v[e])
-    elif isinstance(dictionary, list):
-        for e in range(len(dictionary)):
-            modify_txt_fields(dictionary[e])
+def manifest_path(package):
+    return f"{MANIFESTS_FOLDER}{package}.json"
 
+# Lists the notices of an extracted package as (name, path) pairs
+def list_package_notices(package_path):
+    xml_paths = []
+    for root, _, files in os.walk(package_path):
+        xml_paths += [os.path.join(root, xml_file) for xml_file in files if xml_file.endswith(".xml")]
+    return [(xml_path, xml_path) for xml_path in xml_paths]
 
-# Preformats the xml, selecting only Contract Award Notices and preformatting P text fields so opensearch may index them as they had a variable structure.
-def format_dict(notice):
-    is_eforms = True
-    if "TED_EXPORT" in notice:
-        notice = notice["TED_EXPORT"]
-    if "CODED_DATA_SECTION" in notice:
-        is_eforms = False
-        try:
-            doc_ojs = notice["CODED_DATA_SECTION"]["NOTICE_DATA"]["NO_DOC_OJS"]
-            notice_id = doc_ojs.split("-")[-1].zfill(8) + "-" + doc_ojs[:4]
-            notice_clean = {
-                "CODED_DATA_SECTION": notice["CODED_DATA_SECTION"],
-                "CONTRACT_AWARD_NOTICE": notice["FORM_SECTION"]["F03_2014"]
-            }
-            modify_p_fields(notice_clean)
-        except KeyError as e:
-            raise
+# Yields (name, process_notice result) in the same order as notices, with at most `window` notices in flight
+def process_notices(notices, executor, window):
+    if executor is None:
+        for name, source in notices:
+            yield name, process_notice(source, XML_PARSER, PRECLASSIFY)
+        return
+    pending = deque()
+    for name, source in notices:
+        pending.append((name, executor.submit(process_notice, source, XML_PARSER, PRECLASSIFY)))
+        if len(pending) >= window:
+            name, future = pending.popleft()
+            yield name, future.result()
+    while pending:
+        name, future = pending.popleft()
+        yield name, future.result()
 
-    else:  # "ContractAwardNotice" in notice:
-        try:
-            notice_clean = notice['ContractAwardNotice']
-            notice_id = \
-            notice_clean['ext:UBLExtensions']['ext:UBLExtension']['ext:ExtensionContent']['efext:EformsExtension'][
-                'efac:Publication']['efbc:NoticePublicationID']['#text']
-            modify_txt_fields(notice_clean)
-            notice_clean = {k: v for k, v in notice_clean.items() if not k.startswith('@')} #Clean namespace tags
-        except KeyError as e:
-            raise
-    return is_eforms, notice_id, notice_clean
+# Uploads the notices of a package, given as (name, path or XML bytes) pairs, parsed in executor when given (a process
+# pool shared by the uploads, started before the stage threads). Notices already indexed by a previous,
+# interrupted run of the package (same name and content in its manifest) are skipped. When a notice fails, or is
+# rejected by the bulk API, the package is not completed: its manifest is kept and RuntimeError is raised so the OJS
+# is not marked as ingested, and the next run retries the notices missing from the manifest.
+def ted_xml_upload(package, notices, total=None, executor=None):
+    manifest = NoticeManifest(manifest_path(package))
+    hashes = {}  # Content hash of the notices being processed, by name
+    indexed = {}  # Name of the notices sent to the indexer, by doc id
+    rejected = []  # (doc id, error) of the notices the bulk API did not index
 
+    def on_result(index, doc_id, ok, error):  # Logged once the outcome of the action is known
+        name = indexed.pop(doc_id, None)
+        if ok:
+            if name is not None:
+                manifest.record(name, hashes.pop(name), doc_id)
+            generate_log(package, doc_id, index, 'success', None)
+        else:
+            rejected.append((doc_id, error))
+            generate_log(package, doc_id, index, 'failed', str(error))
 
-# Single-doc helper kept but refresh disabled (unused in bulk path)
-def index_doc_opensearch(doc_id, doc, index):
+    indexer = BulkIndexer(OS_CLIENT, batch_bytes=BULK_BATCH_BYTES, on_result=on_result)
+    skipped = 0
+    failed_notice = None
+    completed = False
     try:
-        OS_CLIENT.index(
-            index=index,
-            body=doc,
-            id=doc_id,
-            refresh=False
-        )
-    except Exception as e:
-        print(f"Error during indexing: {e}")
-
-def generate_log(package,doc_id,index,status,error):
-    return pd.DataFrame([{'package': package,
-                        '_id': doc_id,
-                        '_index': index,
-                        'status': status,
-                        'error': error,
-                        'date': dt.now().strftime('%Y-%m-%d %H:%M:%S')
-                    }])
+        with tqdm(total=total, desc=f"Processing {package}", colour='white', unit='file',
+                  bar_format="{desc}: |{bar}| {n}/{total}") as pbar:
 
-def ted_xml_upload(package, package_path):
-    logs = []
-    BULK_CHUNK = 250  # contracts per bulk request
-    actions = []  # accumulate bulk actions
-    for root, _, files in os.walk(package_path):
-        xml_files = [xml_file for xml_file in files if xml_file.endswith(".xml")]
-        if xml_files:
-            with tqdm(total=len(xml_files), desc=f"Processing {package}", colour='white', unit='file',
-                      bar_format="{desc}: |{bar}| {n}/{total}") as pbar:
+            def pending_notices():
+                nonlocal skipped
+                for name, source in notices:
+                    digest = notice_hash(source)
+                    if manifest.unchanged(name, digest):
+                        skipped += 1
+                        pbar.update(1)
+                        continue
+                    hashes[name] = digest
+                    yield name, source
 
-                for xml_file in xml_files:
-                    xml_path = os.path.join(root, xml_file)
-                    index = INDEX_XML
-                    with open(xml_path, 'r', encoding='utf-8') as file:  # Reads and parses XML files to json
-                        xml_data = file.read()
-                        xml_dict = xmltodict.parse(xml_data)
-                        try:
-                            # print(xml_dict)
-                            is_eforms, doc_id, xml_processed = format_dict(xml_dict)
-                            if is_eforms:
-                                index = INDEX_EFORMS
-                            index_doc_opensearch(doc_id, xml_processed, index)
-                            actions.append({
-                                "_op_type": "index",
-                                "_index": index,
-                                "_id": doc_id,
-                                "_source": xml_processed
-                            })
-                            # When chunk full, send bulk request
-                            if len(actions) >= BULK_CHUNK:
-                                for attempt in range(5):
-                                    try:
-                                        helpers.bulk(OS_CLIENT, actions, refresh=False, chunk_size=BULK_CHUNK)
-                                        actions.clear()
-                                        sleep(1)
-                                        break
-                                    except Exception as bulk_err:
-                                        print(f"Error during bulk indexing (attempt {attempt+1}): {bulk_err}")
-                                        sleep(2 * (2 ** attempt))  # exponential backoff
-                            logs.append(generate_log(package, doc_id, index, 'success', None))
-                            pbar.update(1)
-                        except KeyError as keyerror:
-                            if keyerror.args[0] not in ('F03_2014', 'ContractAwardNotice'):
-                                print(f"exception{keyerror}")
-                                logs.append(generate_log(package, xml_path, index, 'failed',
-                                                         'Key Error:' + str(keyerror)))
-                                break
-                            else:
-                                pbar.update(1)
-                                logs.append(generate_log(package, xml_path, index, 'discarded', 'Not CAN'))
-                                pass
-                        except Exception as e:
-                            logs.append(generate_log(package, xml_path, None, 'failed', 'Error:' + str(e)))
-                            print(e)
-                            traceback.print_exc()
-                            print(json.dumps(xml_dict, indent=4))
-                            break
-    # flush remaining actions after package processed
-    if actions:
-        for attempt in range(5):
-            try:
-                helpers.bulk(OS_CLIENT, actions, refresh=False, chunk_size=BULK_CHUNK)
-                sleep(1)
-                break
-            except Exception as bulk_err:
-                print(f"Error during final bulk indexing (attempt {attempt+1}): {bulk_err}")
-                sleep(2 * (2 ** attempt))  # exponential backoff
-    logs_df = pd.concat(logs, ignore_index=True)
-    file_exists = os.path.exists(LOGS_PATH)
-    logs_df.to_csv(LOGS_PATH, mode='a', header=not file_exists, index=False)
+            results = process_notices(pending_notices(), executor, window=4 * XML_WORKERS)
+            for xml_path, (status, is_eforms, doc_id, xml_processed, error) in results:
+                if is_eforms is None:
+                    index = None
+                else:
+                    index = INDEX_EFORMS if is_eforms else INDEX_XML
+                if status == 'success':
+                    indexed[doc_id] = xml_path
+                    xml_processed[INGESTION_TIMESTAMP_FIELD] = ingestion_timestamp()  # Read by the processing watermarks
+                    indexer.add({
+                        "_op_type": "index",
+                        "_index": index,
+                        "_id": doc_id,
+                        "_source": xml_processed
+                    })
+                    pbar.update(1)
+                elif status == 'discarded':
+                    pbar.update(1)
+                    manifest.record(xml_path, hashes.pop(xml_path))
+                    generate_log(package, xml_path, index, 'discarded', error)
+                else:
+                    generate_log(package, xml_path, index, 'failed', error)
+                    failed_notice = (xml_path, error)
+                    break
+        indexer.flush()  # Remaining actions after package processed
+        completed = failed_notice is None and not rejected
+    finally:
+        if completed:
+            manifest.remove()
+        elif len(manifest):
+            manifest.save()
+    if skipped:
+        print(f"{package}: {skipped} notices already ingested by a previous run, skipped")
+    if failed_notice is not None:
+        raise RuntimeError(f"notice {failed_notice[0]} failed ({failed_notice[1]}), {len(manifest)} notices kept in the manifest")
+    if rejected:
+        doc_id, error = rejected[0]
+        raise RuntimeError(f"{len(rejected)} notices rejected by the bulk API (first: {doc_id}, {error}), "
+                           f"{len(manifest)} notices kept in the manifest")
 
 
+# OJS numbers of a year already marked as ingested in pipeline_status, fetched with a single query
+def ingested_ojs(client, year):
+    prefix = f"xml-ingestion-{year}-"
+    query = {
+        "query": {"bool": {"filter": [{"term": {"year": year}}, {"exists": {"field": "ojs"}}]}},
+        "_source": False,
+        "size": MAX_OJS_PER_YEAR
+    }
+    response = client.search(index="pipeline_status", body=query)
+    return {int(hit["_id"][len(prefix):]) for hit in response["hits"]["hits"] if hit["_id"].startswith(prefix)}
 
-def ted_xml_ingestion(year):
+# Downloads, extracts and uploads the OJS packages of a year as a pipeline: package N+1 is downloaded while package N
+# is parsed and indexed. The packages to ingest are discovered first (one pipeline_status query and concurrent HEAD
+# requests), results come back in OJS order, so packages are still marked as completed in order.
+# In 'stream' PACKAGE_MODE a package is downloaded, decompressed and parsed by a single stage, UPLOAD_WORKERS > 1
+# overlaps several packages.
+def ted_xml_ingestion(year, executor=None):
     doc_id_year = f"xml-ingestion-{year}"
     if OS_CLIENT.exists(index="pipeline_status", id=doc_id_year):
         print(f"Year {year} already marked as completed. Skipping.")
         return
 
-    ojs = 1
+    ingested = ingested_ojs(OS_CLIENT, year)
+    work, end_status = discover_packages(BASE_URL, year, ingested, workers=PROBE_WORKERS, window=PROBE_WINDOW)
+    print(f"Year {year}: {len(ingested)} OJS already ingested, {len(work)} to ingest")
 
-    while True:
-        doc_id_ojs = f"xml-ingestion-{year}-{ojs}"
-        if OS_CLIENT.exists(index="pipeline_status", id=doc_id_ojs):
-            print(f"OJS {year}-{ojs} already ingested. Skipping.")
-            ojs += 1
-            continue
-        download_url = f"{BASE_URL}{year}{str(ojs).zfill(5)}"
-        save_path = f"{BASE_FOLDER}{year}/{str(ojs)}.tar.gz"
-        package = f'{year}-{ojs}'
+    def download(ojs):
+        print(f"Downloading {package_url(BASE_URL, year, ojs)}")
+        return ojs, PACKAGE_CACHE.fetch(year, ojs)
+
+    def extract(package):
+        ojs, archive_path = package
+        package_path = f"{BASE_FOLDER}{year}/{ojs}"
+        extract_file(archive_path, package_path)
+        return ojs, package_path
+
+    def upload(package):
+        ojs, package_path = package
+        notices = list_package_notices(package_path)
         try:
-            # If ojs not on os_ojs:
-            print(f"Downloading {download_url}")
-            wget.download(download_url, out=save_path)
-            print("")
-            extract_file(save_path)
-            ted_xml_upload(package, save_path[:-7])
-            shutil.rmtree(save_path[:-7])  # Removes package folder after upload
+            ted_xml_upload(f'{year}-{ojs}', notices, total=len(notices), executor=executor)
+        finally:
+            shutil.rmtree(package_path)  # Removes package folder after upload
+        return ojs
+
+    def stream_upload(ojs):  # Notices are decompressed and parsed while the package is still downloading
+        print(f"Streaming {package_url(BASE_URL, year, ojs)}")
+        with PACKAGE_CACHE.open(year, ojs) as archive:
+            ted_xml_upload(f'{year}-{ojs}', iter_package_notices(archive), executor=executor)
+        return ojs
+
+    if PACKAGE_MODE == 'stream':
+        stages = [(stream_upload, UPLOAD_WORKERS)]
+    else:
+        stages = [(download, DOWNLOAD_WORKERS), (extract, EXTRACT_WORKERS), (upload, UPLOAD_WORKERS)]
+    failures = 0
+    for ojs, _, error in run_stages(work, stages, queue_size=STAGE_QUEUE_SIZE):
+        package = f'{year}-{ojs}'
+        if error is None:
             log_pipeline_status(OS_CLIENT, year, ojs)
-        # else:
-        # print (f"OJS: {year}{str(ojs).zfill(5) already in OpenSearch")
-        except HTTPError as e:
-            if e.code == 404:
-                print(f"HTTP Error 404: {package} not Found - . Exiting loop.")
-                # Check if next year's OJS 1 package exists online
-                next_year = year + 1
-                next_url = f"{BASE_URL}{next_year}00001"
-                if url_exists(next_url):
-                    print(f"\nNext year ({next_year}) OJS 1 exists. Marking {year} as complete.")
-                    log_pipeline_status(OS_CLIENT, year)
-                else:
-                    print(f"Next year ({next_year}) OJS 1 not yet published. Not marking {year} as complete.")
-                break
-            else:
-                print(f"Failed to download {download_url}: HTTP Error {e.code}")
-        except Exception as e:
-            print(f"Failed to process {package}: {e}")
-        ojs += 1
+            if not KEEP_PACKAGES:
+                PACKAGE_CACHE.remove(year, ojs)
+            continue
+        failures += 1
+        if isinstance(error, HTTPError):
+            print(f"Failed to download {package_url(BASE_URL, year, ojs)}: HTTP Error {error.code}")
+        else:
+            print(f"Failed to process {package}: {error}")
+
+    if end_status != 404:
+        print(f"Could not find the last OJS of {year} (status {end_status}). Not marking {year} as complete.")
+    elif failures:
+        print(f"{failures} OJS of {year} failed. Not marking {year} as complete.")
+    else:
+        # Check if next year's OJS 1 package exists online
+        next_year = year + 1
+        if url_exists(package_url(BASE_URL, next_year, 1)):
+            print(f"\nNext year ({next_year}) OJS 1 exists. Marking {year} as complete.")
+            log_pipeline_status(OS_CLIENT, year)
+        else:
+            print(f"Next year ({next_year}) OJS 1 not yet published. Not marking {year} as complete.")
 
 #                               ------------ CODE -----------------
 
-if not os.path.exists(BASE_FOLDER):
-    os.makedirs(BASE_FOLDER)
-for year in range(START_YEAR, END_YEAR + 1):
-    year_folder = f"{BASE_FOLDER}{year}/"  # Temp yearly packages folder
-    if not os.path.exists(year_folder):
-        os.makedirs(year_folder)
-    ted_xml_ingestion(year)
-    shutil.rmtree(year_folder)
-shutil.rmtree(BASE_FOLDER)
\ No newline at end of file
+if __name__ == "__main__":
+    if not os.path.exists(BASE_FOLDER):
+        os.makedirs(BASE_FOLDER)
+    # Parsing processes, started before the threads of the upload stages
+    xml_executor = start_process_pool(XML_WORKERS) if XML_WORKERS > 1 else None
+    try:
+        for year in range(START_YEAR, END_YEAR + 1):
+            year_folder = f"{BASE_FOLDER}{year}/"  # Temp yearly packages folder
+            if not os.path.exists(year_folder):
+                os.makedirs(year_folder)
+            try:
+                ted_xml_ingestion(year, xml_executor)
+            finally:
+                INGESTION_LOG.flush()
+            shutil.rmtree(year_folder)
+    finally:
+        if xml_executor is not None:
+            xml_executor.shutdown(cancel_futures=True)
+    shutil.rmtree(BASE_FOLDER)
\ No newline at end of file